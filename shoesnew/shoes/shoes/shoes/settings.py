@@ -172,7 +172,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Session settings for guest checkout
 SESSION_COOKIE_AGE = 86400  # 24 hours
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False  # Sessions are only written when they change (cart changes touch them)
 
 # Authentication settings
 LOGIN_URL = '/login/'
@@ -188,17 +188,64 @@ TELEGRAM_CHAT_ID = '-1002706827089'      # Your channel or chat ID (e.g., -10012
 SITE_URL = 'https://al-qathifi.com'
 
 
+# Product gallery settings
+PRODUCT_GALLERY_SHUFFLE = False  # Show product detail gallery images in random order
+
 # Wheel of Fortune settings
 DEFAULT_WHEEL_DISCOUNT = 5  # Default 5% discount
 
 # Cache settings for performance
-CACHES = {
-    'default': {
+# CACHE_BACKEND selects the cache backend:
+#   'redis'  - Redis server at REDIS_URL (requires the redis package). Use it in
+#              production: it is the only option here whose incr() is atomic
+#              across worker processes (cache version stamps, cache statistics).
+#   'file'   - files under CACHE_LOCATION. Single server, single worker process
+#              only: incr() is get-then-set and every write lists the directory.
+#   'db'     - database table (run: python manage.py createcachetable). Single
+#              worker process only, incr() is not atomic.
+#   'locmem' - per-process memory, for development only
+# Defaults to redis when REDIS_URL is set, otherwise file.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'file')
+CACHE_BACKENDS = {
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        # Culling drops a random third of all entries (version stamps included),
+        # so keep the limit well above the per-page/per-visitor working set
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shoes_cache_table',
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+    'locmem': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
+    },
+}
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'alqathifi'),  # Keeps sites sharing a server apart
+        'VERSION': int(os.environ.get('CACHE_VERSION', 1)),  # Bump on deploy to drop all old entries
+        'TIMEOUT': 300,
     }
 }
 
+# Catalog page/fragment cache (invalidated by model version stamps)
+CATALOG_CACHE_TIMEOUT = 600  # Seconds
+
+# Product views are buffered and written in batches every interval: in one
+# shared Redis hash with the redis cache, otherwise in each worker's memory.
+# Memory buffers are written on the worker's next view after the interval and
+# when it exits; a worker that is killed loses its unwritten views.
+VIEW_COUNT_FLUSH_INTERVAL = 60  # Seconds
+
 # Email settings (for order confirmations)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development
 DEFAULT_FROM_EMAIL = 'noreply@alqadhafi-shoes.com'
@@ -213,6 +260,10 @@ CURRENCY_SYMBOL = '₪'       # Set currency to shekels
 LIBRE_TRANSLATE_URL = 'https://libretranslate.de/translate'
 LIBRE_TRANSLATE_API_KEY = None  # Set if using paid version
 
+# Order worker settings (manage.py run_order_worker)
+ORDER_EVENT_MAX_ATTEMPTS = 8  # Give up on a channel after this many tries
+ORDER_EVENT_RETRY_DELAY = 30  # Seconds before the first retry, doubled each time
+
 # Print settings
 ENABLE_AUTO_PRINT = True
 PRINTER_NAME = 'U80II(U)'  # Thermal printer model
@@ -4,11 +4,11 @@ Admin configuration for AL-QATHIFI Men's Shoe Store
 
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Sum, Count
+from django.db.models import Exists, OuterRef, Sum, Count
 from django.utils import timezone
 from datetime import datetime, timedelta
 from .models import (
-    Brand, Product, ProductImage, Customer, Order, OrderItem,
+    Brand, Product, ProductImage, ProductVariant, Customer, Order, OrderItem, OrderEvent,
     CartItem, WheelSpin, WheelConfiguration, UserProfile, ContactMessage,
     ColorVariant, WheelAdminControl
 )
@@ -102,32 +102,62 @@ class ProductImageInline(admin.TabularInline):
     main_photo_status.short_description = "حالة الصورة"
 
 
+class ProductVariantInline(admin.TabularInline):
+    model = ProductVariant
+    extra = 1
+    fields = ['size', 'color_variant', 'stock']
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['image_preview', 'name', 'brand', 'price', 'color', 'stock_quantity', 'views_count', 'is_featured', 'is_active']
     list_filter = ['brand', 'color', 'is_featured', 'is_active', 'created_at']
     search_fields = ['name', 'name_en', 'name_he', 'brand__name']
+    # Sizes and stock are summed from the variants inline; products without
+    # variants keep editing them directly (see get_readonly_fields)
     readonly_fields = ['created_at', 'updated_at', 'views_count']
+    variant_fields = ['sizes', 'stock_quantity']
     list_editable = ['price', 'stock_quantity', 'is_featured', 'is_active']
-    inlines = [ProductImageInline]
+    inlines = [ProductVariantInline, ProductImageInline]
     
     fields = ('name', 'brand', 'description', 'price', 'sizes', 'color', 'color_hex', 'stock_quantity', 'is_featured', 'is_active', 'name_en', 'name_he')
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('brand')
+        return super().get_queryset(request).select_related('brand').annotate(
+            has_variants=Exists(ProductVariant.objects.filter(product=OuterRef('pk')))
+        )
+    
+    def get_readonly_fields(self, request, obj=None):
+        # Products without variants keep their product-level sizes and stock until variants are entered
+        if obj is not None and obj.variants.exists():
+            return self.readonly_fields + self.variant_fields
+        return self.readonly_fields
+    
+    def get_changelist_formset(self, request, **kwargs):
+        formset = super().get_changelist_formset(request, **kwargs)
+        
+        class VariantStockFormSet(formset):
+            def add_fields(self, form, index):
+                super().add_fields(form, index)
+                # Stock of products with variants is the variant total; only the others edit it in bulk
+                if getattr(form.instance, 'has_variants', False) and 'stock_quantity' in form.fields:
+                    form.fields['stock_quantity'].disabled = True
+        
+        return VariantStockFormSet
     
     def image_preview(self, obj):
-        # Get the main product image
-        main_image = obj.images.filter(is_main=True).first()
-        if main_image and main_image.image:
-            return format_html('<img src="{}" width="50" height="50" style="border-radius: 4px;" />', main_image.image.url)
-        # If no main image, get the first available image
-        first_image = obj.images.first()
-        if first_image and first_image.image:
-            return format_html('<img src="{}" width="50" height="50" style="border-radius: 4px;" />', first_image.image.url)
+        # Denormalized thumbnail, no image query per row
+        thumbnail = obj.get_thumbnail()
+        if thumbnail:
+            return format_html('<img src="{}" width="50" height="50" style="border-radius: 4px;" />', thumbnail.url)
         return "لا توجد صورة"
     image_preview.short_description = "الصورة"
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Re-sync the denormalized main image once all inline images are saved
+        form.instance.refresh_main_image()
+
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -161,15 +191,9 @@ class OrderItemInline(admin.TabularInline):
     fields = ['image_preview', 'product', 'size', 'quantity', 'price', 'total_price']
 
     def image_preview(self, obj):
-        product = obj.product
-        # Get the main product image
-        main_image = product.images.filter(is_main=True).first()
-        if main_image and main_image.image:
-            return format_html('<img src="{}" width="100" height="100" style="border-radius: 4px;" />', main_image.image.url)
-        # Fallback to the first image if no main image is set
-        first_image = product.images.first()
-        if first_image and first_image.image:
-            return format_html('<img src="{}" width="100" height="100" style="border-radius: 4px;" />', first_image.image.url)
+        thumbnail = obj.product.get_thumbnail()
+        if thumbnail:
+            return format_html('<img src="{}" width="100" height="100" style="border-radius: 4px;" />', thumbnail.url)
         return "لا توجد صورة"
     image_preview.short_description = "الصورة"
 
@@ -235,6 +259,21 @@ class OrderAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('customer')
     
+    def save_model(self, request, obj, form, change):
+        """Cancelling here returns stock the same way as the customer's cancel"""
+        from django.db import transaction
+        from .utils import OrderService
+        
+        with transaction.atomic():
+            if change:
+                # Keep the stored flag: a customer cancel may have released the stock meanwhile
+                obj.stock_reserved = Order.objects.select_for_update().values_list(
+                    'stock_reserved', flat=True
+                ).get(pk=obj.pk)
+            super().save_model(request, obj, form, change)
+            if change and 'status' in form.changed_data and obj.status == 'cancelled':
+                OrderService.restock_order(obj)
+    
     def print_selected_orders(self, request, queryset):
         """Print selected orders"""
         from .utils import PrintService
@@ -271,6 +310,38 @@ class OrderAdmin(admin.ModelAdmin):
     test_printer.short_description = "اختبار الطابعة"
 
 
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['order', 'event_type', 'file_status', 'telegram_status', 'print_status', 'attempts', 'next_attempt_at', 'completed_at', 'created_at']
+    list_filter = ['event_type', 'file_status', 'telegram_status', 'print_status', 'created_at']
+    search_fields = ['order__order_id', 'order__customer__full_name']
+    readonly_fields = ['order', 'event_type', 'attempts', 'locked_until', 'last_error', 'completed_at', 'created_at']
+    actions = ['retry_failed_channels']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('order', 'order__customer')
+
+    def retry_failed_channels(self, request, queryset):
+        """Queue failed channels again"""
+        from .utils import OrderEventService
+
+        retried = 0
+        for event in queryset:
+            failed = [channel for channel in event.CHANNELS if getattr(event, f'{channel}_status') == 'failed']
+            if not failed:
+                continue
+            for channel in failed:
+                setattr(event, f'{channel}_status', 'pending')
+            event.attempts = 0
+            event.next_attempt_at = timezone.now()
+            event.completed_at = None
+            event.save()
+            retried += 1
+        OrderEventService.wake_worker()
+        self.message_user(request, f'تمت إعادة جدولة {retried} حدث.')
+    retry_failed_channels.short_description = "إعادة محاولة القنوات الفاشلة"
+
+
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['user', 'product', 'size', 'quantity', 'created_at']
@@ -4,6 +4,7 @@ Analytics views for Admin Dashboard
 
 from django.contrib import admin
 from django.shortcuts import render
+from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db.models import Sum, Count, Avg, Q, F
 from django.db.models.functions import TruncMonth, TruncDay, TruncWeek
@@ -24,6 +25,7 @@ except ImportError:
     PlotlyJSONEncoder = None
 
 from .models import Order, OrderItem, Product, Brand, Customer, WheelSpin, ContactMessage
+from .utils import CatalogCacheService, CacheHealthService
 
 
 def safe_chart_creation(chart_func, *args, **kwargs):
@@ -247,6 +249,9 @@ def analytics_dashboard(request):
         count=Count('id')
     ).order_by('-count')[:10]
     
+    # Catalog page/fragment cache effectiveness
+    cache_stats = CatalogCacheService.get_stats()
+    
     context = {
         'total_orders': total_orders,
         'total_revenue': total_revenue,
@@ -262,6 +267,7 @@ def analytics_dashboard(request):
         'city_distribution': city_distribution,
         'days_range': days_range,
         'start_date': start_date,
+        'cache_stats': cache_stats,
         'plotly_available': PLOTLY_AVAILABLE
     }
     
@@ -342,4 +348,11 @@ def sales_report(request):
         'payment_breakdown': payment_breakdown,
     }
     
-    return render(request, 'admin/sales_report.html', context) 
\ No newline at end of file
+    return render(request, 'admin/sales_report.html', context) 
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def cache_health(request):
+    """Cache backend health check and statistics (JSON)"""
+    report = CacheHealthService.check()
+    return JsonResponse(report, status=200 if report['healthy'] else 503)
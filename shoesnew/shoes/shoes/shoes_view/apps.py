@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShoesViewConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shoes_view'
+
+    def ready(self):
+        from . import signals  # noqa: F401
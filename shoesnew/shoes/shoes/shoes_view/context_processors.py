@@ -4,7 +4,7 @@ Provides global context data to all templates.
 """
 
 from django.conf import settings
-from .models import CartItem
+from .utils import CartService
 
 
 def cart_context(request):
@@ -15,17 +15,10 @@ def cart_context(request):
     cart_total = 0
     
     try:
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            # For authenticated users with database cart
-            cart_items = CartItem.objects.filter(user=request.user)
-            cart_count = sum(item.quantity for item in cart_items)
-            cart_total = sum(item.get_total_price() for item in cart_items)
-        else:
-            # For session-based cart (guest users)
-            if hasattr(request, 'session') and request.session.get('cart'):
-                cart = request.session['cart']
-                cart_count = sum(item['quantity'] for item in cart.values())
-                cart_total = sum(float(item['price']) * item['quantity'] for item in cart.values())
+        if hasattr(request, 'user') and hasattr(request, 'session'):
+            cart_summary = CartService.get_summary(request)
+            cart_count = cart_summary.count
+            cart_total = cart_summary.total
     except Exception as e:
         # Log error but don't break the page
         import logging
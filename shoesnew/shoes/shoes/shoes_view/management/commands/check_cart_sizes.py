@@ -0,0 +1,59 @@
+"""
+Check that products without variants only sell the sizes they list: the
+add-to-cart view rejects an unlisted size and checkout rejects a cart line in
+one, while a listed size still goes through.
+
+Works on a temporary brand and product inside a transaction that is rolled
+back, so nothing is left in the database.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from shoes_view.models import Brand, CartItem, Product
+from shoes_view.utils import OrderService, OutOfStockError
+
+
+class Command(BaseCommand):
+    help = 'Check that unlisted sizes of products without variants cannot be added to the cart or ordered'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            try:
+                self.check_sizes()
+            finally:
+                transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Unlisted sizes are rejected by the cart and at checkout'))
+
+    def check_sizes(self):
+        brand = Brand.objects.create(name='check_cart_sizes')
+        product = Product.objects.create(
+            name='check_cart_sizes', brand=brand, price=100, sizes=['40', '42'], color='black', stock_quantity=5
+        )
+        client = Client(SERVER_NAME='localhost')
+
+        def add(size):
+            data = {'product_id': product.pk, 'size': size, 'color': 'black', 'quantity': 1}
+            return client.post(reverse('shoes_view:add_to_cart'), data).json()
+
+        if add('47')['success']:
+            raise CommandError('A size the product does not list was added to the cart')
+        if not add('42')['success']:
+            raise CommandError('A listed size in stock was not added to the cart')
+
+        # A line in an unlisted size that got into the cart some other way
+        session_key = client.session.session_key
+        CartItem.objects.create(product=product, size='47', color='black', quantity=1, session_key=session_key)
+        request = client.get(reverse('shoes_view:cart')).wsgi_request
+        form_data = {
+            'full_name': 'check_cart_sizes', 'phone': '0500000000', 'city': 'check',
+            'address': 'check', 'payment_method': 'cash',
+        }
+        try:
+            OrderService.place_order(request, form_data)
+        except OutOfStockError as e:
+            self.stdout.write(f'Checkout rejected: {e}')
+        else:
+            raise CommandError('An order was placed for a size the product does not list')
@@ -0,0 +1,99 @@
+"""
+Simulate wheel spins against the compiled prize table: compare the observed
+outcome frequencies with the configured probabilities (chi-square) and report
+spins per second against the old cumulative walk.
+
+Uses the live wheel configuration, or synthetic weights with --weights.
+Admin control modes are not applied; this checks the weighted draw only.
+"""
+
+import math
+import random
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shoes_view.utils import WheelPrizeTable, WheelService
+
+
+class Command(BaseCommand):
+    help = 'Check the wheel prize distribution over simulated spins and benchmark the sampler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spins', type=int, default=1_000_000,
+                            help='Simulated spins (default: 1000000)')
+        parser.add_argument('--weights', default='',
+                            help='Comma-separated synthetic probabilities instead of the live configuration')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed, for reproducible runs')
+        parser.add_argument('--benchmark', type=int, default=200_000,
+                            help='Spins per timed run (default: 200000, 0 to skip)')
+
+    def handle(self, *args, **options):
+        if options['weights']:
+            try:
+                weights = [int(weight) for weight in options['weights'].split(',')]
+            except ValueError:
+                raise CommandError('--weights must be comma-separated integers')
+            configs = [
+                SimpleNamespace(pk=index, name=f'#{index}', prize_type='discount', probability=weight, can_win=True)
+                for index, weight in enumerate(weights)
+            ]
+            table = WheelPrizeTable(configs)
+        else:
+            table = WheelService.get_prize_table()
+        if not table.outcomes:
+            raise CommandError('The wheel has no winnable segments')
+
+        rng = random.Random(options['seed'])
+        self.check_distribution(table, options['spins'], rng)
+        if options['benchmark']:
+            self.benchmark(table, options['benchmark'], rng)
+
+    def check_distribution(self, table, spins, rng):
+        counts = dict.fromkeys(table.outcomes, 0)
+        for _ in range(spins):
+            counts[table.sample(rng)] += 1
+
+        expected = table.expected()
+        chi_square = 0.0
+        self.stdout.write(f'{"segment":<30} {"expected":>10} {"observed":>10}')
+        for index, probability in expected.items():
+            observed = counts[index] / spins
+            chi_square += (counts[index] - probability * spins) ** 2 / (probability * spins)
+            self.stdout.write(f'{table.configs[index].name[:30]:<30} {probability:>10.4%} {observed:>10.4%}')
+
+        degrees = len(expected) - 1
+        limit = self.chi_square_limit(degrees)
+        self.stdout.write(f'chi-square {chi_square:.2f} with {degrees} degrees of freedom (limit {limit:.2f})')
+        if degrees and chi_square > limit:
+            raise CommandError('Observed distribution does not match the configured probabilities')
+        self.stdout.write(self.style.SUCCESS(f'Distribution OK over {spins} spins'))
+
+    @staticmethod
+    def chi_square_limit(degrees, z=3.09):
+        """Critical value at p=0.001 (Wilson-Hilferty approximation)"""
+        if not degrees:
+            return 0.0
+        return degrees * (1 - 2 / (9 * degrees) + z * math.sqrt(2 / (9 * degrees))) ** 3
+
+    def benchmark(self, table, spins, rng):
+        # The previous selection: walk the cumulative probabilities on each spin
+        weighted = [(table.configs[index], weight) for index, weight in zip(table.outcomes, table.weights)]
+
+        def cumulative_walk():
+            total = sum(weight for _, weight in weighted)
+            random_num = rng.randint(1, total)
+            current = 0
+            for config, weight in weighted:
+                current += weight
+                if random_num <= current:
+                    return config
+
+        for label, spin in (('alias table', lambda: table.sample(rng)), ('cumulative walk', cumulative_walk)):
+            started = time.perf_counter()
+            for _ in range(spins):
+                spin()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label:<16} {spins / elapsed:>12,.0f} spins/s')
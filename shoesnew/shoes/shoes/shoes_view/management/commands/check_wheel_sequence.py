@@ -0,0 +1,58 @@
+"""
+Fire parallel sequence steps at a temporary (inactive) WheelAdminControl and
+check that every sequence position is handed out exactly once per round.
+
+Run it against the production database engine; SQLite serializes writers
+and cannot show lost updates.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shoes_view.models import WheelAdminControl
+
+
+class Command(BaseCommand):
+    help = 'Check that concurrent wheel spins in sequence mode never share a sequence position'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, default=50,
+                            help='Sequence length (default: 50)')
+        parser.add_argument('--rounds', type=int, default=4,
+                            help='Times the whole sequence is consumed (default: 4)')
+        parser.add_argument('--threads', type=int, default=16,
+                            help='Parallel workers (default: 16)')
+
+    def handle(self, *args, **options):
+        length, rounds = options['length'], options['rounds']
+        if length < 1 or rounds < 1:
+            raise CommandError('--length and --rounds must be positive')
+
+        control = WheelAdminControl.objects.create(
+            name='check_wheel_sequence', control_mode='sequence',
+            sequence_prizes=list(range(length)), is_active=False
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                positions = list(executor.map(lambda _: self.step(control.pk, length), range(length * rounds)))
+            cursor = WheelAdminControl.objects.values_list('current_sequence_index', flat=True).get(pk=control.pk)
+        finally:
+            control.delete()
+
+        counts = Counter(positions)
+        wrong = {position: count for position, count in counts.items() if count != rounds}
+        missing = set(range(length)) - set(counts)
+        self.stdout.write(f'{len(positions)} spins on {options["threads"]} threads, cursor back at {cursor}')
+        if wrong or missing or cursor != 0:
+            raise CommandError(f'Sequence positions handed out unevenly: {wrong or sorted(missing)}')
+        self.stdout.write(self.style.SUCCESS(f'Each of {length} positions handed out exactly {rounds} times'))
+
+    @staticmethod
+    def step(control_id, length):
+        try:
+            return WheelAdminControl.advance_sequence(control_id, length)
+        finally:
+            connection.close()  # Each worker thread has its own connection
@@ -0,0 +1,21 @@
+"""
+Delete guest cart rows whose session has expired. Run it next to Django's
+`clearsessions`, e.g. from a daily cron job.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shoes_view.models import CartItem
+
+
+class Command(BaseCommand):
+    help = 'Delete guest cart items not touched within the session lifetime'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        deleted, _ = CartItem.objects.filter(user=None, updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} guest cart items'))
@@ -0,0 +1,25 @@
+"""
+Write the product views buffered in the shared Redis hash to
+Product.views_count. Views are also flushed during requests every
+VIEW_COUNT_FLUSH_INTERVAL seconds; run this from cron or before a deploy
+that clears the cache.
+
+Without the redis cache every worker buffers its own views in memory, which
+this command cannot reach; the workers flush them themselves after the
+interval and when they exit.
+"""
+
+from django.core.management.base import BaseCommand
+
+from shoes_view.utils import ViewCounterService
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered product view counts to the database'
+
+    def handle(self, *args, **options):
+        if ViewCounterService.get_redis_client() is None:
+            self.stdout.write(self.style.WARNING('Views are buffered per worker process without the redis cache; nothing to flush here'))
+            return
+        total = ViewCounterService.flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {total} product views'))
@@ -0,0 +1,69 @@
+"""
+Generate resized WebP/JPEG variants for existing product images, brand
+logos and color swatches, then re-sync the denormalized main image columns
+on Product.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+
+from shoes_view.models import Brand, ColorVariant, Product, ProductImage
+from shoes_view.utils import ImageService
+
+
+# (model, image field, variants field)
+IMAGE_SOURCES = [
+    (ProductImage, 'image', 'variants'),
+    (Brand, 'logo', 'logo_variants'),
+    (ColorVariant, 'thumbnail', 'thumbnail_variants'),
+]
+
+
+def _render_variants(image_name):
+    """Worker entry point - storage only, the parent process writes to the database"""
+    return ImageService.render_variants(image_name)
+
+
+class Command(BaseCommand):
+    help = 'Generate missing image variants (80/240/480/960px, WebP + JPEG) and refresh Product image columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants even if they are up to date')
+
+    def handle(self, *args, **options):
+        # Collect every instance whose variants are missing or stale
+        pending = {}
+        for model, image_field, variants_field in IMAGE_SOURCES:
+            for instance in model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True}).iterator():
+                image_name = getattr(instance, image_field).name
+                variants = getattr(instance, variants_field)
+                if options['force'] or not ImageService.variants_are_current(variants, image_name):
+                    pending.setdefault(image_name, []).append((instance, variants_field))
+
+        self.stdout.write(f'Generating variants for {len(pending)} images with {options["workers"]} workers...')
+
+        generated = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = {executor.submit(_render_variants, name): name for name in pending}
+            for future in as_completed(futures):
+                image_name = futures[future]
+                try:
+                    variants = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'Failed: {image_name}: {e}')
+                    continue
+                for instance, variants_field in pending[image_name]:
+                    ImageService.save_variants(instance, variants_field, variants)
+                generated += 1
+
+        for product in Product.objects.all().iterator():
+            product.refresh_main_image()
+
+        self.stdout.write(self.style.SUCCESS(f'Generated {generated} images, {failed} failed'))
@@ -0,0 +1,32 @@
+"""
+Recompute the precomputed related-products lists. The order worker
+refreshes flagged products on its own; use --all after an import or to
+rebuild everything.
+"""
+
+from django.core.management.base import BaseCommand
+
+from shoes_view.models import Product
+from shoes_view.utils import RelatedProductService
+
+
+class Command(BaseCommand):
+    help = 'Recompute related products for flagged products (or all with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every active product, not only flagged ones')
+        parser.add_argument('--batch', type=int, default=200,
+                            help='Products computed per batch (default: 200)')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            Product.objects.filter(is_active=True).update(related_stale=True)
+
+        total = 0
+        while True:
+            refreshed = RelatedProductService.refresh_stale(options['batch'])
+            if not refreshed:
+                break
+            total += refreshed
+        self.stdout.write(self.style.SUCCESS(f'Refreshed related products for {total} products'))
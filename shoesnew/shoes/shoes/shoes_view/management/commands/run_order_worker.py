@@ -0,0 +1,53 @@
+"""
+Process the order outbox: write order files, send Telegram notifications
+and print receipts outside the checkout request. When idle it also
+recomputes flagged related-products lists.
+
+Run it as a long-lived process (systemd, supervisor), or from cron with
+--once.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shoes_view.utils import OrderEventService, RelatedProductService
+
+
+class Command(BaseCommand):
+    help = 'Run order side effects (file, Telegram, print) queued by checkout, with retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the due events and exit (for cron)')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls when idle (default: 5)')
+        parser.add_argument('--batch', type=int, default=10,
+                            help='Events claimed per poll (default: 10)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Order worker started')
+        try:
+            while True:
+                close_old_connections()
+                processed = OrderEventService.process_due_events(options['batch'])
+                if processed:
+                    self.stdout.write(f'Processed {processed} order events')
+                    continue
+                if RelatedProductService.refresh_stale():
+                    continue
+                if options['once']:
+                    break
+                self.wait(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Order worker stopped')
+
+    def wait(self, interval):
+        """Sleep until the interval passes or checkout signals new events"""
+        deadline = time.monotonic() + interval
+        while time.monotonic() < deadline:
+            if OrderEventService.consume_wakeup():
+                return
+            time.sleep(0.5)
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0011_alter_order_payment_method'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productimage',
+            options={'ordering': ['product_id', '-is_main', 'order', 'id'], 'verbose_name': 'صورة المنتج', 'verbose_name_plural': 'صور المنتجات'},
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', '-is_main', 'order', 'id'], name='productimage_gallery_idx'),
+        ),
+    ]
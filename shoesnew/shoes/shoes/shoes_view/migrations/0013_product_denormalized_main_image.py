@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+def backfill_main_images(apps, schema_editor):
+    """Copy the current main image and image count onto every product"""
+    Product = apps.get_model('shoes_view', 'Product')
+    ProductImage = apps.get_model('shoes_view', 'ProductImage')
+
+    images_by_product = {}
+    for image in ProductImage.objects.order_by('product_id', '-is_main', 'order', 'id'):
+        images_by_product.setdefault(image.product_id, []).append(image)
+
+    for product in Product.objects.all():
+        images = images_by_product.get(product.pk, [])
+        Product.objects.filter(pk=product.pk).update(
+            main_image=images[0].image.name if images else '',
+            image_count=len(images),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0012_productimage_gallery_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='عدد الصور'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_image',
+            field=models.ImageField(blank=True, editable=False, max_length=255, upload_to='products/', verbose_name='الصورة الرئيسية'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_thumbnail',
+            field=models.ImageField(blank=True, editable=False, max_length=255, upload_to='thumbnails/', verbose_name='الصورة المصغرة'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, max_length=255, upload_to='thumbnails/', verbose_name='صورة مصغرة'),
+        ),
+        migrations.RunPython(backfill_main_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0013_product_denormalized_main_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='brand',
+            name='logo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='أحجام الشعار'),
+        ),
+        migrations.AddField(
+            model_name='colorvariant',
+            name='thumbnail_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='أحجام الصورة المصغرة'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='أحجام الصورة الرئيسية'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='أحجام الصورة'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0014_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('placed', 'طلب جديد'), ('cancelled', 'إلغاء طلب')], max_length=20, verbose_name='نوع الحدث')),
+                ('file_status', models.CharField(choices=[('pending', 'في الانتظار'), ('done', 'تم'), ('failed', 'فشل'), ('skipped', 'تم التخطي')], default='pending', max_length=10, verbose_name='حالة الملف')),
+                ('telegram_status', models.CharField(choices=[('pending', 'في الانتظار'), ('done', 'تم'), ('failed', 'فشل'), ('skipped', 'تم التخطي')], default='pending', max_length=10, verbose_name='حالة تيليجرام')),
+                ('print_status', models.CharField(choices=[('pending', 'في الانتظار'), ('done', 'تم'), ('failed', 'فشل'), ('skipped', 'تم التخطي')], default='pending', max_length=10, verbose_name='حالة الطباعة')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='موعد المحاولة التالية')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='محجوز حتى')),
+                ('last_error', models.TextField(blank=True, verbose_name='آخر خطأ')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='تاريخ الإنجاز')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='shoes_view.order', verbose_name='الطلب')),
+            ],
+            options={
+                'verbose_name': 'حدث طلب',
+                'verbose_name_plural': 'أحداث الطلبات',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['completed_at', 'next_attempt_at'], name='orderevent_due_idx')],
+            },
+        ),
+    ]
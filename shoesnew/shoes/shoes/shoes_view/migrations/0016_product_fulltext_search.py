@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:20
+
+from django.db import migrations
+
+FULLTEXT_INDEXES = (
+    ('product_search_ft', 'shoes_view_product', ('name', 'name_en', 'name_he', 'description')),
+    ('brand_search_ft', 'shoes_view_brand', ('name', 'name_en', 'name_he')),
+)
+
+
+def create_fulltext_indexes(apps, schema_editor):
+    """FULLTEXT with the ngram parser (Arabic and Hebrew have no InnoDB stemmer); MySQL only"""
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for name, table, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {name} ON {table} ({', '.join(columns)}) WITH PARSER ngram"
+        )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for name, table, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(f"DROP INDEX {name} ON {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0015_order_event_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_indexes, drop_fulltext_indexes),
+    ]
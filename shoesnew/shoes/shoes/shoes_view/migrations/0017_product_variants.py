@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Existing products get no variants: per-size counts are unknown, so they keep
+# selling against their product-level stock until an admin enters the sizes.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0016_product_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='sizes',
+            field=models.JSONField(default=list, editable=False, verbose_name='المقاسات المتاحة'),
+        ),
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('38', '38'), ('39', '39'), ('40', '40'), ('41', '41'), ('42', '42'), ('43', '43'), ('44', '44'), ('45', '45'), ('46', '46'), ('47', '47')], max_length=10, verbose_name='المقاس')),
+                ('stock', models.PositiveIntegerField(default=0, verbose_name='الكمية المتاحة')),
+                ('color_variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_variants', to='shoes_view.colorvariant', verbose_name='متغير اللون')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='shoes_view.product', verbose_name='المنتج')),
+            ],
+            options={
+                'verbose_name': 'مقاس المنتج',
+                'verbose_name_plural': 'مقاسات المنتجات',
+                'ordering': ['product_id', 'size'],
+                'indexes': [models.Index(fields=['size', 'stock', 'product'], name='productvariant_size_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'size', 'color_variant'), name='productvariant_unique')],
+            },
+        ),
+    ]
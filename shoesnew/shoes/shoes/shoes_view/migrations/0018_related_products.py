@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:06
+
+import django.db.models.deletion
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_variant_groups(apps, schema_editor):
+    """Same computation as Product.make_variant_group (model methods are not available here)"""
+    Product = apps.get_model('shoes_view', 'Product')
+    for product in Product.objects.only('id', 'brand_id', 'name'):
+        normalized = ' '.join((product.name or '').split()).lower()
+        group = f"{product.brand_id}:{hashlib.md5(normalized.encode('utf-8')).hexdigest()[:16]}"
+        Product.objects.filter(pk=product.pk).update(variant_group=group)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0017_product_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='related_stale',
+            field=models.BooleanField(db_index=True, default=True, editable=False, verbose_name='المنتجات ذات الصلة بحاجة للتحديث'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='variant_group',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='مجموعة المتغيرات'),
+        ),
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(default=0, verbose_name='الدرجة')),
+                ('reason', models.CharField(choices=[('co_purchase', 'اشتُري معاً'), ('color', 'نفس الألوان'), ('brand', 'نفس العلامة التجارية'), ('price', 'سعر مشابه')], max_length=20, verbose_name='السبب الرئيسي')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_links', to='shoes_view.product', verbose_name='المنتج')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_in', to='shoes_view.product', verbose_name='المنتج المرتبط')),
+            ],
+            options={
+                'verbose_name': 'منتج ذو صلة',
+                'verbose_name_plural': 'المنتجات ذات الصلة',
+                'ordering': ['product_id', '-score'],
+                'indexes': [models.Index(fields=['product', '-score'], name='relatedproduct_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='relatedproduct_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_variant_groups, migrations.RunPython.noop),
+    ]
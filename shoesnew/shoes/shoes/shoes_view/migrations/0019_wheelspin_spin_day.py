@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:11
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_spin_days(apps, schema_editor):
+    """Local calendar day of each existing spin, matching the old spin_date__date lookups"""
+    WheelSpin = apps.get_model('shoes_view', 'WheelSpin')
+    for spin in WheelSpin.objects.only('id', 'spin_date').iterator():
+        spin_day = django.utils.timezone.localdate(spin.spin_date)
+        WheelSpin.objects.filter(pk=spin.pk).update(spin_day=spin_day)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0018_related_products'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wheelspin',
+            name='spin_day',
+            field=models.DateField(default=django.utils.timezone.localdate, editable=False, verbose_name='يوم الدوران'),
+        ),
+        migrations.RunPython(backfill_spin_days, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='wheelspin',
+            index=models.Index(fields=['user', 'spin_day'], name='wheelspin_user_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wheelspin',
+            index=models.Index(fields=['session_key', 'spin_day'], name='wheelspin_session_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wheelspin',
+            index=models.Index(fields=['user', 'is_used'], name='wheelspin_user_unused_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wheelspin',
+            index=models.Index(fields=['session_key', 'is_used'], name='wheelspin_session_unused_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0019_wheelspin_spin_day'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_reserved',
+            field=models.BooleanField(default=False, editable=False, verbose_name='تم حجز المخزون'),
+        ),
+    ]
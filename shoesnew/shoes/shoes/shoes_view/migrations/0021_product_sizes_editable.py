@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shoes_view', '0020_order_stock_reserved'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='sizes',
+            field=models.JSONField(default=list, verbose_name='المقاسات المتاحة'),
+        ),
+    ]
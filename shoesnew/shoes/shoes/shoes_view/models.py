@@ -2,11 +2,13 @@
 Models for AL-QATHIFI Men's Shoe Store
 """
 
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from django.urls import reverse
+import hashlib
 import uuid
 
 
@@ -16,6 +18,7 @@ class Brand(models.Model):
     name_en = models.CharField(max_length=100, blank=True, verbose_name="Brand Name (English)")
     name_he = models.CharField(max_length=100, blank=True, verbose_name="Brand Name (Hebrew)")
     logo = models.ImageField(upload_to='brands/', blank=True, null=True, verbose_name="شعار العلامة التجارية")
+    logo_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="أحجام الشعار")
     description = models.TextField(blank=True, verbose_name="وصف العلامة التجارية")
     is_active = models.BooleanField(default=True, verbose_name="نشط")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -39,6 +42,7 @@ class ColorVariant(models.Model):
     code = models.CharField(max_length=20, unique=True, verbose_name="كود اللون")
     hex_color = models.CharField(max_length=7, default='#000000', verbose_name="كود اللون الهكس")
     thumbnail = models.ImageField(upload_to='colors/', blank=True, null=True, verbose_name="صورة مصغرة للون")
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="أحجام الصورة المصغرة")
     
     class Meta:
         verbose_name = "متغير اللون"
@@ -49,6 +53,118 @@ class ColorVariant(models.Model):
         return self.name
 
 
+def main_image_prefetch(lookup='images'):
+    """
+    Prefetch for product images ordered so the main image comes first.
+    Pass a related lookup (e.g. 'product__images') for cart and order items.
+    Product cards no longer need it (see ProductQuerySet.for_listing), but
+    get_main_image() still reads the prefetched rows for products whose
+    denormalized image is empty.
+    """
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by('-is_main', 'order', 'id')
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    """Queryset helpers for product listings"""
+
+    # Columns needed to render a product card (image data is denormalized on Product)
+    LISTING_FIELDS = (
+        'id', 'name', 'name_en', 'name_he', 'price', 'stock_quantity', 'is_featured',
+        'created_at', 'main_image', 'main_thumbnail', 'main_image_variants', 'image_count',
+        'brand__id', 'brand__name',
+    )
+
+    def for_listing(self):
+        """Load only the card columns, with no joins to the image table"""
+        return self.select_related('brand').only(*self.LISTING_FIELDS)
+
+    def with_main_image(self):
+        """Earlier name for for_listing(): the main image is now a column on Product"""
+        return self.for_listing()
+
+    # Columns covered by the FULLTEXT indexes added in migration 0016
+    FULLTEXT_FIELDS = ('name', 'name_en', 'name_he', 'description')
+    BRAND_FULLTEXT_FIELDS = ('name', 'name_en', 'name_he')
+    # MySQL's ngram parser ignores terms shorter than ngram_token_size (default 2)
+    FULLTEXT_MIN_LENGTH = 2
+
+    @staticmethod
+    def size_q(size):
+        """
+        Condition for stock in a size: a variant with stock (from the variant
+        (size, stock) index), or for products without variants yet, the size
+        listed on the product and product-level stock
+        """
+        if connection.vendor == 'sqlite':
+            listed = models.Q(sizes__icontains=f'"{size}"')  # No JSON contains on SQLite
+        else:
+            listed = models.Q(sizes__contains=[size])
+        return (
+            models.Q(id__in=ProductVariant.objects.filter(size=size, stock__gt=0).values('product_id')) |
+            (models.Q(~models.Exists(ProductVariant.objects.filter(product=models.OuterRef('pk')))) &
+             listed & models.Q(stock_quantity__gt=0))
+        )
+
+    def with_size(self, size):
+        """Products with stock in a size"""
+        return self.filter(self.size_q(size))
+
+    def without_variants(self):
+        """Products still sold against their product-level stock"""
+        return self.exclude(models.Exists(ProductVariant.objects.filter(product=models.OuterRef('pk'))))
+
+    def after(self, field, descending, value, pk):
+        """Keyset page: rows strictly after (value, pk) in the (field, id) ordering"""
+        lookup = 'lt' if descending else 'gt'
+        return self.filter(
+            models.Q(**{f'{field}__{lookup}': value}) |
+            models.Q(**{field: value, f'id__{lookup}': pk})
+        )
+
+    def search(self, query):
+        """
+        Filter by a search query and annotate a `relevance` score.
+        Uses MATCH ... AGAINST on MySQL, icontains on other databases.
+        """
+        if connection.vendor == 'mysql' and len(query) >= self.FULLTEXT_MIN_LENGTH:
+            product_table = self.model._meta.db_table
+            brand_table = Brand._meta.db_table
+            product_match = "MATCH({}) AGAINST (%s IN NATURAL LANGUAGE MODE)".format(
+                ', '.join(f"{product_table}.{field}" for field in self.FULLTEXT_FIELDS)
+            )
+            brand_match = "MATCH({}) AGAINST (%s IN NATURAL LANGUAGE MODE)".format(
+                ', '.join(f"search_brand.{field}" for field in self.BRAND_FULLTEXT_FIELDS)
+            )
+            brand_ids = f"SELECT search_brand.id FROM {brand_table} search_brand WHERE {brand_match}"
+            brand_score = (
+                f"(SELECT {brand_match} FROM {brand_table} search_brand "
+                f"WHERE search_brand.id = {product_table}.brand_id)"
+            )
+            return self.filter(
+                RawSQL(f"({product_match} OR {product_table}.brand_id IN ({brand_ids}))",
+                       [query, query], output_field=models.BooleanField())
+            ).annotate(
+                relevance=RawSQL(f"{product_match} + COALESCE({brand_score}, 0)",
+                                 [query, query], output_field=models.FloatField())
+            )
+
+        return self.filter(
+            models.Q(name__icontains=query) |
+            models.Q(name_en__icontains=query) |
+            models.Q(brand__name__icontains=query)
+        ).annotate(
+            relevance=models.Case(
+                models.When(models.Q(name__iexact=query) | models.Q(name_en__iexact=query), then=3.0),
+                models.When(models.Q(name__istartswith=query) | models.Q(name_en__istartswith=query), then=2.0),
+                default=1.0,
+                output_field=models.FloatField(),
+            )
+        )
+
+
 class Product(models.Model):
     """Product model for shoes"""
     SIZES = [
@@ -83,7 +199,8 @@ class Product(models.Model):
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='products', verbose_name="العلامة التجارية")
     description = models.TextField(blank=True, verbose_name="وصف المنتج")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="السعر")
-    sizes = models.JSONField(default=list, verbose_name="المقاسات المتاحة")  # Store multiple sizes
+    # Denormalized from ProductVariant by refresh_variants() (see signals.py) once the product has variants
+    sizes = models.JSONField(default=list, verbose_name="المقاسات المتاحة")
     color = models.CharField(max_length=20, choices=COLORS, verbose_name="اللون", blank=True, null=True)
     color_hex = models.CharField(max_length=7, default='#000000', verbose_name="كود اللون")
     stock_quantity = models.PositiveIntegerField(default=0, verbose_name="الكمية المتاحة")
@@ -92,6 +209,18 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     views_count = models.PositiveIntegerField(default=0, verbose_name="عدد المشاهدات")
+    # Products sharing a variant group are the same model in other colors (see make_variant_group)
+    variant_group = models.CharField(max_length=64, blank=True, db_index=True, editable=False, verbose_name="مجموعة المتغيرات")
+    # Set when orders or catalog edits change this product's related list (see RelatedProductService)
+    related_stale = models.BooleanField(default=True, db_index=True, editable=False, verbose_name="المنتجات ذات الصلة بحاجة للتحديث")
+
+    # Denormalized from ProductImage by refresh_main_image() (see signals.py)
+    main_image = models.ImageField(upload_to='products/', max_length=255, blank=True, editable=False, verbose_name="الصورة الرئيسية")
+    main_thumbnail = models.ImageField(upload_to='thumbnails/', max_length=255, blank=True, editable=False, verbose_name="الصورة المصغرة")
+    main_image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="أحجام الصورة الرئيسية")
+    image_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="عدد الصور")
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = "منتج"
@@ -101,17 +230,75 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.name} - {self.brand.name}"
 
+    def save(self, *args, **kwargs):
+        self.variant_group = self.make_variant_group(self.brand_id, self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'brand'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'variant_group'}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def make_variant_group(brand_id, name):
+        """Same brand and same name means the same model in another color"""
+        normalized = ' '.join((name or '').split()).lower()
+        return f"{brand_id}:{hashlib.md5(normalized.encode('utf-8')).hexdigest()[:16]}"
+
     def get_absolute_url(self):
         return reverse('shoes_view:product_detail', kwargs={'product_id': self.pk})
 
     def get_main_image(self):
         """Get the main product image"""
+        # Denormalized copy kept in sync with the images table
+        if self.main_image:
+            return self.main_image
+        if not self.image_count:
+            return None
+
+        # Use prefetched images when available
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is not None:
+            images = list(prefetched)
+            for image in images:
+                if image.is_main:
+                    return image.image
+            return images[0].image if images else None
+
         main_image = self.images.filter(is_main=True).first()
         if main_image:
             return main_image.image
         first_image = self.images.first()
         return first_image.image if first_image else None
 
+    def get_thumbnail(self):
+        """Get the pre-generated thumbnail, falling back to the main image"""
+        return self.main_thumbnail or self.get_main_image()
+
+    def refresh_main_image(self):
+        """Copy the main image, its thumbnail/variants and the image count onto the product"""
+        images = list(ProductImage.objects.filter(product_id=self.pk).only('image', 'thumbnail', 'variants', 'is_main'))
+        main = images[0] if images else None  # Default ordering puts the main image first
+        self.main_image = main.image.name if main else ''
+        self.main_thumbnail = main.thumbnail.name if main else ''
+        self.main_image_variants = main.variants if main else {}
+        self.image_count = len(images)
+        # Queryset update: no post_save for Product and updated_at is left alone
+        Product.objects.filter(pk=self.pk).update(
+            main_image=self.main_image,
+            main_thumbnail=self.main_thumbnail,
+            main_image_variants=self.main_image_variants,
+            image_count=self.image_count,
+        )
+
+    def refresh_variants(self):
+        """Copy the variant sizes and the total variant stock onto the product"""
+        rows = list(ProductVariant.objects.filter(product_id=self.pk).values_list('size', 'stock'))
+        variant_sizes = {size for size, stock in rows}
+        self.sizes = [size for size, label in self.SIZES if size in variant_sizes]
+        self.sizes += sorted(variant_sizes - set(self.sizes))
+        self.stock_quantity = sum(stock for size, stock in rows)
+        # Queryset update: no post_save for Product (cache versions are bumped by the caller)
+        Product.objects.filter(pk=self.pk).update(sizes=self.sizes, stock_quantity=self.stock_quantity)
+
     def get_color_images(self):
         """Get images for the current color"""
         return self.images.filter(color=self.color)
@@ -125,57 +312,85 @@ class Product(models.Model):
         currency_symbol = getattr(settings, 'CURRENCY_SYMBOL', '₪')
         return f"{self.price} {currency_symbol}"
     
+    # Cached get_available_colors() result: (updated_at, colors); cleared by signals on image/color changes
+    COLORS_CACHE_KEY = 'catalog:product-colors:{product_id}'
+    COLOR_HEX_MAP = {
+        'black': '#000000', 'white': '#FFFFFF', 'brown': '#8B4513',
+        'blue': '#0000FF', 'red': '#FF0000', 'gray': '#808080',
+        'green': '#008000', 'yellow': '#FFFF00', 'navy': '#000080',
+        'beige': '#F5F5DC',
+    }
+
     def get_available_colors(self):
         """
         Get all available colors for this product.
         This method is robust and handles both the new ColorVariant system
         and the old legacy color field system to prevent colors from disappearing.
         """
+        from django.core.cache import cache
+        from .utils import CatalogCacheService
+
+        key = self.COLORS_CACHE_KEY.format(product_id=self.pk)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == self.updated_at:
+            return cached[1]
+
+        colors = self._compute_available_colors()
+        cache.set(key, (self.updated_at, colors), CatalogCacheService.get_timeout())
+        return colors
+
+    def _compute_available_colors(self):
+        """One pass over the (prefetched) images, no per-color queries"""
+        from .utils import ImageService
+
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is None:
+            prefetched = self.images.select_related('color_variant')
+        images = sorted(prefetched, key=lambda image: (image.order, image.id))
+
         found_colors = {}
 
         # 1. Prioritize images linked to a ColorVariant
-        images_with_variants = self.images.filter(color_variant__isnull=False).select_related('color_variant').order_by('order')
-        for image in images_with_variants:
+        for image in images:
             variant = image.color_variant
-            if variant.code not in found_colors:
-                found_colors[variant.code] = {
-                    'code': variant.code,
-                    'name': variant.name,
-                    'hex': variant.hex_color,
-                    'thumbnail_url': variant.thumbnail.url if variant.thumbnail else image.image.url,
-                    'image_url': image.image.url
-                }
+            if variant is None or variant.code in found_colors:
+                continue
+            swatch_path = ImageService.get_variant_path(variant.thumbnail_variants, 80)
+            if swatch_path:
+                thumbnail_url = variant.thumbnail.storage.url(swatch_path)
+            else:
+                thumbnail_url = variant.thumbnail.url if variant.thumbnail else image.image.url
+            found_colors[variant.code] = {
+                'code': variant.code,
+                'name': variant.name,
+                'hex': variant.hex_color,
+                'thumbnail_url': thumbnail_url,
+                'image_url': image.image.url
+            }
 
         # 2. Fallback for images with the legacy 'color' field
         if not found_colors:
-            image_colors = self.images.filter(color__isnull=False).exclude(color__exact='').values_list('color', flat=True).distinct()
-            colors_to_process = set(image_colors)
-            if self.color:
-                colors_to_process.add(self.color)
-
-            for color_code in colors_to_process:
-                if color_code not in found_colors:
-                    color_name = dict(self.COLORS).get(color_code, color_code)
-                    color_hex_map = {
-                        'black': '#000000', 'white': '#FFFFFF', 'brown': '#8B4513',
-                        'blue': '#0000FF', 'red': '#FF0000', 'gray': '#808080',
-                        'green': '#008000', 'yellow': '#FFFF00', 'navy': '#000080',
-                        'beige': '#F5F5DC',
+            color_images = {}
+            for image in images:
+                if image.color:
+                    color_images.setdefault(image.color, image)
+            color_codes = list(color_images)
+            if self.color and self.color not in color_images:
+                color_codes.append(self.color)
+
+            main_image = self.get_main_image()
+            for color_code in color_codes:
+                color_image = color_images.get(color_code)
+                image_url = color_image.image.url if color_image else (main_image.url if main_image else None)
+                if image_url:
+                    found_colors[color_code] = {
+                        'code': color_code,
+                        'name': dict(self.COLORS).get(color_code, color_code),
+                        'hex': self.COLOR_HEX_MAP.get(color_code, '#CCCCCC'),
+                        'thumbnail_url': image_url,
+                        'image_url': image_url
                     }
-                    hex_code = color_hex_map.get(color_code, '#CCCCCC')
-                    
-                    color_image = self.images.filter(color=color_code).first()
-                    image_url = color_image.image.url if color_image else self.get_main_image().url if self.get_main_image() else None
-
-                    if image_url:
-                        found_colors[color_code] = {
-                            'code': color_code,
-                            'name': color_name,
-                            'hex': hex_code,
-                            'thumbnail_url': image_url,
-                            'image_url': image_url
-                        }
-        
+
         return list(found_colors.values())
 
 
@@ -188,16 +403,88 @@ class ProductImage(models.Model):
     is_main = models.BooleanField(default=False, verbose_name="الصورة الرئيسية")
     alt_text = models.CharField(max_length=200, blank=True, verbose_name="نص بديل")
     order = models.PositiveIntegerField(default=0, verbose_name="الترتيب")
+    thumbnail = models.ImageField(upload_to='thumbnails/', max_length=255, blank=True, editable=False, verbose_name="صورة مصغرة")
+    variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="أحجام الصورة")
 
     class Meta:
         verbose_name = "صورة المنتج"
         verbose_name_plural = "صور المنتجات"
-        ordering = ['-is_main', '?']
+        # Deterministic ordering served by the composite index below (no ORDER BY RAND())
+        ordering = ['product_id', '-is_main', 'order', 'id']
+        indexes = [
+            models.Index(fields=['product', '-is_main', 'order', 'id'], name='productimage_gallery_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.get_color_display()}"
 
 
+class RelatedProduct(models.Model):
+    """Precomputed "related products" list entry (see RelatedProductService)"""
+    REASONS = [
+        ('co_purchase', 'اشتُري معاً'),
+        ('color', 'نفس الألوان'),
+        ('brand', 'نفس العلامة التجارية'),
+        ('price', 'سعر مشابه'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_links', verbose_name="المنتج")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_in', verbose_name="المنتج المرتبط")
+    score = models.FloatField(default=0, verbose_name="الدرجة")
+    reason = models.CharField(max_length=20, choices=REASONS, verbose_name="السبب الرئيسي")
+
+    class Meta:
+        verbose_name = "منتج ذو صلة"
+        verbose_name_plural = "المنتجات ذات الصلة"
+        ordering = ['product_id', '-score']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='relatedproduct_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='relatedproduct_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score:.2f})"
+
+
+class ProductVariantQuerySet(models.QuerySet):
+    """Queryset helpers for stock lookups"""
+
+    def for_item(self, size, color):
+        """Variants a cart line draws from: the one for its color first, then the size-only one"""
+        return self.filter(size=size).filter(
+            models.Q(color_variant__isnull=True) | models.Q(color_variant__code=color)
+        ).order_by(models.F('color_variant').asc(nulls_last=True))
+
+
+class ProductVariant(models.Model):
+    """Stock of one product size, optionally for a single color"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants', verbose_name="المنتج")
+    size = models.CharField(max_length=10, choices=Product.SIZES, verbose_name="المقاس")
+    color_variant = models.ForeignKey(ColorVariant, on_delete=models.CASCADE, null=True, blank=True, related_name='product_variants', verbose_name="متغير اللون")
+    stock = models.PositiveIntegerField(default=0, verbose_name="الكمية المتاحة")
+
+    objects = ProductVariantQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "مقاس المنتج"
+        verbose_name_plural = "مقاسات المنتجات"
+        ordering = ['product_id', 'size']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'size', 'color_variant'], name='productvariant_unique'),
+        ]
+        indexes = [
+            # Size filter on listings: WHERE size = %s AND stock > 0, covering product_id
+            models.Index(fields=['size', 'stock', 'product'], name='productvariant_size_idx'),
+        ]
+
+    def __str__(self):
+        if self.color_variant_id:
+            return f"{self.product.name} - {self.size} - {self.color_variant.name}"
+        return f"{self.product.name} - {self.size}"
+
+
 class Customer(models.Model):
     """Customer model for guest and registered users"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name="المستخدم")
@@ -251,6 +538,8 @@ class Order(models.Model):
     notes = models.TextField(blank=True, verbose_name="ملاحظات")
     whatsapp_sent = models.BooleanField(default=False, verbose_name="تم إرسال واتساب")
     printed = models.BooleanField(default=False, verbose_name="تمت الطباعة")
+    # Set when checkout decremented stock for this order; cancelling returns it once
+    stock_reserved = models.BooleanField(default=False, editable=False, verbose_name="تم حجز المخزون")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -293,6 +582,49 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 
+class OrderEvent(models.Model):
+    """Outbox of order side effects (file, Telegram, print) run by the order worker"""
+    EVENT_TYPES = [
+        ('placed', 'طلب جديد'),
+        ('cancelled', 'إلغاء طلب'),
+    ]
+
+    CHANNEL_STATUSES = [
+        ('pending', 'في الانتظار'),
+        ('done', 'تم'),
+        ('failed', 'فشل'),
+        ('skipped', 'تم التخطي'),
+    ]
+
+    CHANNELS = ('file', 'telegram', 'print')
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events', verbose_name="الطلب")
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES, verbose_name="نوع الحدث")
+    file_status = models.CharField(max_length=10, choices=CHANNEL_STATUSES, default='pending', verbose_name="حالة الملف")
+    telegram_status = models.CharField(max_length=10, choices=CHANNEL_STATUSES, default='pending', verbose_name="حالة تيليجرام")
+    print_status = models.CharField(max_length=10, choices=CHANNEL_STATUSES, default='pending', verbose_name="حالة الطباعة")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="عدد المحاولات")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="موعد المحاولة التالية")
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="محجوز حتى")
+    last_error = models.TextField(blank=True, verbose_name="آخر خطأ")
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ الإنجاز")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "حدث طلب"
+        verbose_name_plural = "أحداث الطلبات"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['completed_at', 'next_attempt_at'], name='orderevent_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} - {self.order.order_id}"
+
+    def get_pending_channels(self):
+        return [channel for channel in self.CHANNELS if getattr(self, f'{channel}_status') == 'pending']
+
+
 class CartItem(models.Model):
     """Cart item model for authenticated users and guests"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='cart_items', verbose_name="المستخدم")
@@ -328,12 +660,22 @@ class WheelSpin(models.Model):
     gift_description = models.TextField(blank=True, verbose_name="وصف الهدية")
     is_used = models.BooleanField(default=False, verbose_name="تم الاستخدام")
     spin_date = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الدوران")
+    # Local calendar day of the spin (TIME_ZONE), stored so the daily check is an equality lookup
+    spin_day = models.DateField(default=timezone.localdate, editable=False, verbose_name="يوم الدوران")
     used_date = models.DateTimeField(null=True, blank=True, verbose_name="تاريخ الاستخدام")
 
     class Meta:
         verbose_name = "دوران العجلة"
         verbose_name_plural = "دورانات العجلة"
         ordering = ['-spin_date']
+        indexes = [
+            # Daily eligibility: WHERE user_id = %s AND spin_day = %s
+            models.Index(fields=['user', 'spin_day'], name='wheelspin_user_day_idx'),
+            models.Index(fields=['session_key', 'spin_day'], name='wheelspin_session_day_idx'),
+            # Unused prize: WHERE user_id = %s AND is_used = false
+            models.Index(fields=['user', 'is_used'], name='wheelspin_user_unused_idx'),
+            models.Index(fields=['session_key', 'is_used'], name='wheelspin_session_unused_idx'),
+        ]
 
     def __str__(self):
         user_info = self.user.username if self.user else f"Guest ({self.session_key[:10]})"
@@ -348,16 +690,16 @@ class WheelSpin(models.Model):
 
     def can_spin_today(self):
         """Check if user/session can spin today"""
-        today = timezone.now().date()
+        today = timezone.localdate()
         if self.user:
             return not WheelSpin.objects.filter(
                 user=self.user, 
-                spin_date__date=today
+                spin_day=today
             ).exists()
         else:
             return not WheelSpin.objects.filter(
                 session_key=self.session_key, 
-                spin_date__date=today
+                spin_day=today
             ).exists()
 
     def get_prize_display(self):
@@ -402,16 +744,24 @@ class WheelConfiguration(models.Model):
         else:
             return f"{self.name}"
 
-    def get_display_text(self):
+    # Wheel segment text per language; gifts show their name
+    DISPLAY_TEXTS = {
+        'discount': {'ar': "خصم {value}%", 'en': "{value}% off", 'he': "{value}% הנחה"},
+        'free_shipping': {'ar': "شحن مجاني", 'en': "Free shipping", 'he': "משלוח חינם"},
+        'no_prize': {'ar': "حاول مرة أخرى", 'en': "Try again", 'he': "נסה שוב"},
+    }
+
+    def get_display_text(self, language='ar'):
         """Get the text to display on the wheel"""
-        if self.prize_type == 'discount':
-            return f"خصم {self.value}%"
-        elif self.prize_type == 'free_shipping':
-            return "شحن مجاني"
-        elif self.prize_type == 'gift':
+        if self.prize_type == 'gift':
             return self.name
-        else:
-            return "حاول مرة أخرى"
+        texts = self.DISPLAY_TEXTS.get(self.prize_type, self.DISPLAY_TEXTS['no_prize'])
+        return texts.get(language, texts['ar']).format(value=self.value)
+
+    def get_display_texts(self):
+        """Display text in every site language"""
+        from django.conf import settings
+        return {code: self.get_display_text(code) for code, _ in settings.LANGUAGES}
 
 
 class WheelAdminControl(models.Model):
@@ -440,33 +790,26 @@ class WheelAdminControl(models.Model):
     def __str__(self):
         return f"{self.name} - {self.get_control_mode_display()}"
 
-    def get_next_prize(self):
-        """Get the next prize based on control mode"""
-        if self.control_mode == 'force_prize' and self.forced_prize:
-            return self.forced_prize
-        elif self.control_mode == 'force_no_prize':
-            # Return a no-prize configuration
-            no_prize_config = WheelConfiguration.objects.filter(
-                prize_type='no_prize', 
-                is_active=True
-            ).first()
-            return no_prize_config
-        elif self.control_mode == 'sequence' and self.sequence_prizes:
-            if self.current_sequence_index < len(self.sequence_prizes):
-                prize_id = self.sequence_prizes[self.current_sequence_index]
-                try:
-                    prize = WheelConfiguration.objects.get(id=prize_id, is_active=True)
-                    # Move to next in sequence
-                    self.current_sequence_index += 1
-                    if self.current_sequence_index >= len(self.sequence_prizes):
-                        self.current_sequence_index = 0  # Reset to beginning
-                    self.save()
-                    return prize
-                except WheelConfiguration.DoesNotExist:
-                    pass
-        
-        # Default to random mode
-        return None
+    @staticmethod
+    def advance_sequence(control_id, length):
+        """
+        Claim the next sequence position and move the cursor on, wrapping to
+        the start. The UPDATE locks the row until commit, so concurrent spins
+        each get their own position. The claimed position is the cursor before
+        the UPDATE modulo length, so a cursor left past the end (the sequence
+        was shortened) wraps too. Returns None if the control is gone.
+        """
+        with transaction.atomic():
+            updated = WheelAdminControl.objects.filter(pk=control_id).update(
+                current_sequence_index=(models.F('current_sequence_index') % length + 1) % length
+            )
+            if not updated:
+                return None
+            cursor = WheelAdminControl.objects.filter(pk=control_id).values_list(
+                'current_sequence_index', flat=True
+            ).get()
+        # cursor == (previous % length + 1) % length
+        return (cursor - 1) % length
 
 
 class UserProfile(models.Model):
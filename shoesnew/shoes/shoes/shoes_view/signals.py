@@ -0,0 +1,216 @@
+"""
+Signal handlers for AL-QATHIFI Men's Shoe Store
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import (
+    Brand, CartItem, ColorVariant, Product, ProductImage, ProductVariant,
+    WheelAdminControl, WheelConfiguration, WheelSpin,
+)
+from .utils import (
+    CartService, CatalogCacheService, ImageService, RelatedProductService, SearchIndexService,
+    WheelService,
+)
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, raw=False, **kwargs):
+    """Keep the image variants and the product's denormalized image columns in sync"""
+    if raw:
+        return
+    ImageService.ensure_variants(instance, 'image', 'variants')
+    instance.product.refresh_main_image()
+
+
+@receiver(post_delete, sender=ProductImage)
+def product_image_deleted(sender, instance, **kwargs):
+    """Pick a new main image when an image is removed"""
+    product = Product.objects.filter(pk=instance.product_id).first()
+    if product:
+        product.refresh_main_image()
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def product_variant_changed(sender, instance, raw=False, **kwargs):
+    """Keep the product's denormalized sizes and total stock in sync"""
+    if raw:
+        return
+    product = Product.objects.filter(pk=instance.product_id).only('id', 'brand_id').first()
+    if product:
+        product.refresh_variants()
+        invalidate_product(product.pk, product.brand_id)
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, raw=False, **kwargs):
+    """Generate resized variants of the brand logo"""
+    if raw:
+        return
+    ImageService.ensure_variants(instance, 'logo', 'logo_variants')
+
+
+@receiver(post_save, sender=ColorVariant)
+def color_variant_saved(sender, instance, raw=False, **kwargs):
+    """Generate resized variants of the color swatch"""
+    if raw:
+        return
+    ImageService.ensure_variants(instance, 'thumbnail', 'thumbnail_variants')
+
+
+# Catalog cache invalidation
+
+def invalidate_product(product_id, brand_id):
+    """Bump every cache scope a product appears in"""
+    cache.delete(f"catalog:product-brand:{product_id}")
+    CatalogCacheService.bump_version('catalog', f"brand:{brand_id}", f"product:{product_id}")
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Invalidate cached pages showing this product"""
+    if raw or (update_fields and set(update_fields) <= {'views_count'}):
+        return
+    invalidate_product(instance.pk, instance.brand_id)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    """Invalidate cached pages showing the image's product"""
+    if raw:
+        return
+    brand_id = Product.objects.filter(pk=instance.product_id).values_list('brand_id', flat=True).first()
+    invalidate_product(instance.product_id, brand_id)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def brand_changed(sender, instance, raw=False, **kwargs):
+    """Invalidate the brand page and catalog pages listing the brand"""
+    if raw:
+        return
+    CatalogCacheService.bump_version('catalog', f"brand:{instance.pk}")
+
+
+@receiver(post_save, sender=ColorVariant)
+@receiver(pre_delete, sender=ColorVariant)  # Before the images' foreign keys are cleared
+def color_variant_changed(sender, instance, raw=False, **kwargs):
+    """Invalidate the pages of products whose images use this color"""
+    if raw:
+        return
+    rows = ProductImage.objects.filter(color_variant=instance).values_list('product_id', 'product__brand_id').distinct()
+    for product_id, brand_id in rows:
+        invalidate_product(product_id, brand_id)
+    CatalogCacheService.bump_version('catalog')
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_colors_image_changed(sender, instance, raw=False, **kwargs):
+    """The color swatches are derived from the images"""
+    if raw:
+        return
+    cache.delete(Product.COLORS_CACHE_KEY.format(product_id=instance.product_id))
+
+
+@receiver(post_save, sender=ColorVariant)
+@receiver(pre_delete, sender=ColorVariant)
+def product_colors_variant_changed(sender, instance, raw=False, **kwargs):
+    """Swatch name, hex and thumbnail come from the ColorVariant"""
+    if raw:
+        return
+    product_ids = ProductImage.objects.filter(color_variant=instance).values_list('product_id', flat=True).distinct()
+    cache.delete_many([Product.COLORS_CACHE_KEY.format(product_id=product_id) for product_id in product_ids])
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_item_changed(sender, instance, raw=False, **kwargs):
+    """Invalidate the cached cart summary (covers admin edits too)"""
+    if raw:
+        return
+    CatalogCacheService.bump_version(CartService.get_summary_scope(instance.user_id, instance.session_key))
+
+
+@receiver(post_save, sender=WheelSpin)
+@receiver(post_delete, sender=WheelSpin)
+def wheel_spin_changed(sender, instance, raw=False, **kwargs):
+    """Invalidate the cached wheel state of the spin's owner (covers admin edits too)"""
+    if raw:
+        return
+    WheelService.invalidate_state(instance.user_id, instance.session_key)
+
+
+@receiver(post_save, sender=WheelConfiguration)
+@receiver(post_delete, sender=WheelConfiguration)
+@receiver(post_save, sender=WheelAdminControl)
+@receiver(post_delete, sender=WheelAdminControl)
+def wheel_configuration_changed(sender, instance, raw=False, **kwargs):
+    """
+    Recompile the wheel prize table and segment snapshot now rather than on
+    the next spin (sequence steps update the cursor without signals)
+    """
+    if raw:
+        return
+    CatalogCacheService.bump_version('wheel')
+    transaction.on_commit(WheelService.get_prize_table, robust=True)
+
+
+# Search suggestion index (runs after the cache version bumps above)
+
+@receiver(post_save, sender=Product)
+def search_index_product_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not SearchIndexService.INDEXED_FIELDS & set(update_fields)):
+        return
+    SearchIndexService.update_products(pk=instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def search_index_product_deleted(sender, instance, **kwargs):
+    SearchIndexService.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def search_index_image_changed(sender, instance, raw=False, **kwargs):
+    """The suggestion thumbnail comes from the product's main image"""
+    if raw:
+        return
+    SearchIndexService.update_products(pk=instance.product_id)
+
+
+@receiver(post_save, sender=Brand)
+def search_index_brand_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    SearchIndexService.update_products(brand_id=instance.pk)
+
+
+# Related products (recomputed by the order worker)
+
+@receiver(post_save, sender=Product)
+def related_product_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Its own list, its brand's lists and every list it appears in may change"""
+    if raw or (update_fields and set(update_fields) <= {'views_count'}):
+        return
+    RelatedProductService.mark_stale(
+        Q(pk=instance.pk) | Q(brand_id=instance.brand_id) | Q(related_links__related_id=instance.pk)
+    )
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def related_colors_changed(sender, instance, raw=False, **kwargs):
+    """Shared colors are part of the score"""
+    if raw:
+        return
+    RelatedProductService.mark_stale(Q(pk=instance.product_id))
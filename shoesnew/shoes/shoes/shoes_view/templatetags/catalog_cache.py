@@ -0,0 +1,64 @@
+"""
+Template fragment caching for catalog grids, invalidated by model version stamps.
+
+Usage:
+    {% load catalog_cache %}
+    {% catalogcache 'brand_grid' brand %}
+        ...
+    {% endcatalogcache %}
+
+Scopes may be strings ('catalog', 'brand:3') or Brand/Product instances.
+Without scopes the fragment depends on the whole catalog.
+"""
+
+from django import template
+from django.core.cache import cache
+
+from ..models import Brand, Product
+from ..utils import CatalogCacheService
+
+register = template.Library()
+
+
+def _scope(value):
+    if isinstance(value, Brand):
+        return f"brand:{value.pk}"
+    if isinstance(value, Product):
+        return f"product:{value.pk}"
+    return str(value)
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, scopes):
+        self.nodelist = nodelist
+        self.name = name
+        self.scopes = scopes
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        scopes = [_scope(scope.resolve(context)) for scope in self.scopes] or ['catalog']
+        key = CatalogCacheService.make_key(f"fragment:{name}", context.get('request'), scopes)
+
+        content = cache.get(key)
+        if content is not None:
+            CatalogCacheService.record(True)
+            return content
+
+        CatalogCacheService.record(False)
+        content = self.nodelist.render(context)
+        cache.set(key, content, CatalogCacheService.get_timeout())
+        return content
+
+
+@register.tag('catalogcache')
+def do_catalogcache(parser, token):
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    nodelist = parser.parse(('endcatalogcache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:]],
+    )
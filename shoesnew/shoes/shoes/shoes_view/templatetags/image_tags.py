@@ -0,0 +1,66 @@
+"""
+Template tags for responsive images built from generated variants.
+
+Usage:
+    {% load image_tags %}
+    {% product_image product 'card' 'w-full h-56 object-cover' %}
+    {% variant_image brand.logo brand.logo_variants 'logo' 'max-h-20' brand.name %}
+"""
+
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+register = template.Library()
+
+# Which variant widths each layout slot may load and how wide it renders
+PRESETS = {
+    'thumb': {'widths': (80, 240), 'src': 240, 'sizes': '96px'},
+    'card': {'widths': (240, 480, 960), 'src': 480, 'sizes': '(min-width: 1024px) 30vw, (min-width: 640px) 45vw, 33vw'},
+    'logo': {'widths': (80, 240), 'src': 240, 'sizes': '80px'},
+    'detail': {'widths': (480, 960), 'src': 960, 'sizes': '(min-width: 1024px) 50vw, 100vw'},
+}
+
+
+def _srcset(variants, widths, extension):
+    """Build a srcset from stored variants, skipping duplicate widths of small originals"""
+    candidates = {}
+    for width in widths:
+        entry = variants.get('sizes', {}).get(str(width))
+        if entry and entry.get(extension):
+            candidates.setdefault(entry['width'], default_storage.url(entry[extension]))
+    return ', '.join(f'{url} {width}w' for width, url in sorted(candidates.items()))
+
+
+def _render(image, variants, preset, css_class, alt):
+    if not image:
+        return ''
+    config = PRESETS.get(preset, PRESETS['card'])
+
+    if not variants:
+        # Variants not generated yet - plain image
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', image.url, alt, css_class)
+
+    src_entry = variants.get('sizes', {}).get(str(config['src']), {})
+    src = default_storage.url(src_entry['jpg']) if src_entry.get('jpg') else image.url
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy">'
+        '</picture>',
+        _srcset(variants, config['widths'], 'webp'), config['sizes'],
+        src, _srcset(variants, config['widths'], 'jpg'), config['sizes'], alt, css_class,
+    )
+
+
+@register.simple_tag
+def product_image(product, preset='card', css_class='', alt=None):
+    """Render the main image of a product with WebP/JPEG srcsets"""
+    return _render(product.get_main_image(), product.main_image_variants, preset, css_class,
+                   product.name if alt is None else alt)
+
+
+@register.simple_tag
+def variant_image(image, variants, preset='thumb', css_class='', alt=''):
+    """Render any image field that has a matching *_variants field"""
+    return _render(image, variants, preset, css_class, alt)
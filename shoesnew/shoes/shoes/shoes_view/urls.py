@@ -32,6 +32,7 @@ urlpatterns = [
     # Wheel of Fortune
     path('wheel/', views.wheel_of_fortune, name='wheel'),
     path('wheel-api-v2/', views.wheel_api_v2, name='wheel_api_v2'),
+    path('wheel-config.json', views.wheel_config, name='wheel_config'),
     
     # User authentication and profile
     path('register/', views.user_register, name='register'),
@@ -77,6 +78,8 @@ urlpatterns = [
     # AJAX endpoints
     path('search-suggestions/', views.search_suggestions, name='search_suggestions'),
     path('api/cart-count/', views.cart_count_api, name='cart_count_api'),
+    path('api/products/', views.api_products, name='api_products'),
+    path('api/catalog/', views.api_catalog, name='api_catalog'),
     
     # SEO and robots
     path('robots.txt', views.robots_txt, name='robots_txt'),
@@ -2,19 +2,33 @@
 Utility functions for AL-QATHIFI Men's Shoe Store
 """
 
+import atexit
 import requests
 import json
+import hashlib
 import logging
+import re
+import threading
+import time
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
 from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from datetime import datetime
+from decimal import Decimal
 import subprocess
 import platform
 import random
 import os
-from django.utils import timezone
+from django.utils import timezone, translation
+from django.db.models import Count, ExpressionWrapper, F, Sum
 
 logger = logging.getLogger(__name__)
 
@@ -120,7 +134,7 @@ class FileService:
 ----------------
 الاسم: {order.customer.full_name}
 الهاتف: {order.customer.phone}
-البريد الإلكتروني: {order.customer.email if order.customer.email else 'غير متوفر'}
+البريد الإلكتروني: {getattr(order.customer, 'email', '') or 'غير متوفر'}
 المدينة: {order.customer.city}
 العنوان: {order.customer.street_address}
 العنوان الكامل: {order.customer.get_full_address()}
@@ -201,7 +215,7 @@ class FileService:
 ----------------
 الاسم: {order.customer.full_name}
 الهاتف: {order.customer.phone}
-البريد الإلكتروني: {order.customer.email if order.customer.email else 'غير متوفر'}
+البريد الإلكتروني: {getattr(order.customer, 'email', '') or 'غير متوفر'}
 المدينة: {order.customer.city}
 العنوان: {order.customer.street_address}
 العنوان الكامل: {order.customer.get_full_address()}
@@ -1167,6 +1181,1540 @@ class PrintService:
             return None
 
 
+class OutOfStockError(Exception):
+    """Raised when a cart asks for more pieces than are in stock"""
+    
+    def __init__(self, product_name, available):
+        self.product_name = product_name
+        self.available = available
+        super().__init__(f'الكمية المطلوبة من {product_name} غير متوفرة (المتاح: {available})')
+
+
+class OrderService:
+    """Order placement service"""
+    
+    @staticmethod
+    def place_order(request, form_data, discount_percentage=0, free_shipping=False, gift=None):
+        """
+        Turn the current cart into an order in a single transaction.
+        
+        Products are locked with select_for_update and loaded in one query, order
+        items are bulk-created and stock is decremented with one F() update, so
+        concurrent checkouts cannot oversell. Raises OutOfStockError.
+        """
+        from collections import defaultdict
+        from django.db import transaction
+        from django.db.models import Case, PositiveIntegerField, When
+        from .models import Customer, Order, OrderItem, Product, ProductVariant, WheelSpin
+        
+        with transaction.atomic():
+            cart_items = list(CartService.get_items(request).select_related(None))
+            if not cart_items:
+                raise ValueError('Cart is empty')
+            
+            # Lock in a stable order so concurrent checkouts cannot deadlock
+            quantities = defaultdict(int)
+            for item in cart_items:
+                quantities[item.product_id] += item.quantity
+            products = Product.objects.select_for_update().filter(
+                id__in=quantities.keys(), is_active=True
+            ).order_by('id').in_bulk()
+            
+            for item in cart_items:
+                product = products.get(item.product_id)
+                if product is None:
+                    raise OutOfStockError(item.product.name, 0)
+                if product.stock_quantity < quantities[item.product_id]:
+                    raise OutOfStockError(product.name, product.stock_quantity)
+            
+            # Per-size stock, locked after the products in the same stable order
+            variants, products_with_variants = OrderService.match_variants(
+                [(item.product_id, item.size, item.color) for item in cart_items], lock=True
+            )
+            variant_quantities = defaultdict(int)
+            for item in cart_items:
+                if item.product_id not in products_with_variants:
+                    # Product-level stock only covers the sizes the product lists
+                    if item.size not in products[item.product_id].sizes:
+                        raise OutOfStockError(f"{products[item.product_id].name} ({item.size})", 0)
+                    continue
+                variant = variants.get((item.product_id, item.size, item.color))
+                if variant is None:
+                    raise OutOfStockError(f"{products[item.product_id].name} ({item.size})", 0)
+                variant_quantities[variant.pk] += item.quantity
+                if variant.stock < variant_quantities[variant.pk]:
+                    raise OutOfStockError(f"{products[item.product_id].name} ({item.size})", variant.stock)
+            
+            total_amount = sum(products[item.product_id].price * item.quantity for item in cart_items)
+            discount_amount = total_amount * discount_percentage / 100 if discount_percentage else 0
+            
+            customer_data = {
+                'full_name': form_data['full_name'],
+                'phone': form_data['phone'],
+                'city': form_data['city'],
+                'street_address': form_data['address'],
+            }
+            if request.user.is_authenticated:
+                customer, created = Customer.objects.update_or_create(
+                    user=request.user,
+                    defaults=customer_data
+                )
+            else:
+                customer = Customer.objects.create(session_key=request.session.session_key, **customer_data)
+            
+            order = Order.objects.create(
+                customer=customer,
+                payment_method=form_data['payment_method'],
+                total_amount=total_amount,
+                discount_amount=discount_amount,
+                final_amount=total_amount - discount_amount,
+                wheel_free_shipping=free_shipping,
+                wheel_gift_name=gift.get('name', '') if gift else '',
+                wheel_gift_description=gift.get('description', '') if gift else '',
+                notes=form_data.get('notes', ''),
+                stock_reserved=True
+            )
+            
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=products[item.product_id],
+                    size=item.size,
+                    color=item.color,
+                    quantity=item.quantity,
+                    price=products[item.product_id].price,
+                    total_price=products[item.product_id].price * item.quantity
+                )
+                for item in cart_items
+            ])
+            
+            Product.objects.filter(id__in=quantities.keys()).update(
+                stock_quantity=Case(
+                    *[When(id=product_id, then=F('stock_quantity') - quantity) for product_id, quantity in quantities.items()],
+                    default=F('stock_quantity'),
+                    output_field=PositiveIntegerField()
+                ),
+                related_stale=True  # New co-purchases
+            )
+            if variant_quantities:
+                ProductVariant.objects.filter(id__in=variant_quantities.keys()).update(
+                    stock=Case(
+                        *[When(id=variant_id, then=F('stock') - quantity) for variant_id, quantity in variant_quantities.items()],
+                        default=F('stock'),
+                        output_field=PositiveIntegerField()
+                    )
+                )
+            
+            CartService.clear_cart(request)
+            
+            # Mark wheel prizes as used
+            if discount_percentage or free_shipping or gift:
+                if request.user.is_authenticated:
+                    spins = WheelSpin.objects.filter(user=request.user, is_used=False)
+                else:
+                    spins = WheelSpin.objects.filter(session_key=request.session.session_key, is_used=False)
+                spins.update(is_used=True, used_date=timezone.now())
+                wheel_owner = (request.user.pk, None) if request.user.is_authenticated else (None, request.session.session_key)
+                transaction.on_commit(lambda: WheelService.invalidate_state(*wheel_owner, request=request))
+            
+            # Order file, Telegram and printing run in the order worker
+            OrderEventService.enqueue(order, 'placed')
+            
+            # Stock changed without model signals, so refresh cached catalog pages
+            scopes = {'catalog'}
+            for product in products.values():
+                scopes.update({f"brand:{product.brand_id}", f"product:{product.pk}"})
+            transaction.on_commit(lambda: CatalogCacheService.bump_version(*scopes))
+        
+        logger.info(f"Order {order.order_id} placed with {len(cart_items)} items, total {order.final_amount}")
+        return order
+    
+    @staticmethod
+    def match_variants(lines, lock=False):
+        """
+        Resolve (product_id, size, color) lines to the ProductVariant they draw
+        stock from, preferring the color-specific variant over the size-only one.
+        
+        Returns ({line: variant}, ids of the products that have any variants);
+        lines without a matching variant are left out of the mapping.
+        """
+        from .models import ColorVariant, ProductVariant
+        
+        variants = ProductVariant.objects.filter(product_id__in={line[0] for line in lines})
+        if lock:
+            variants = variants.select_for_update().order_by('id')
+        variants = list(variants)
+        color_codes = dict(
+            ColorVariant.objects.filter(
+                id__in={variant.color_variant_id for variant in variants if variant.color_variant_id}
+            ).values_list('id', 'code')
+        )
+        
+        by_key = {
+            (variant.product_id, variant.size, color_codes.get(variant.color_variant_id)): variant
+            for variant in variants
+        }
+        matched = {}
+        for product_id, size, color in lines:
+            variant = by_key.get((product_id, size, color)) or by_key.get((product_id, size, None))
+            if variant is not None:
+                matched[(product_id, size, color)] = variant
+        return matched, {variant.product_id for variant in variants}
+    
+    @staticmethod
+    def restock_order(order):
+        """
+        Return a cancelled order's pieces to stock. Only orders whose stock was
+        decremented at checkout are restocked, and each only once; orders placed
+        before stock was reserved are left alone.
+        """
+        from django.db import transaction
+        from .models import Order
+        
+        with transaction.atomic():
+            # Conditional update so two cancel paths cannot both restock
+            if not Order.objects.filter(pk=order.pk, stock_reserved=True).update(stock_reserved=False):
+                return
+            order.stock_reserved = False
+            OrderService.return_stock(order)
+    
+    @staticmethod
+    def return_stock(order):
+        """Add an order's quantities back to its variants and products"""
+        from collections import defaultdict
+        from django.db import transaction
+        from django.db.models import Case, PositiveIntegerField, When
+        from .models import Product, ProductVariant
+        
+        quantities = defaultdict(int)
+        lines = list(order.items.values_list('product_id', 'size', 'color', 'quantity'))
+        for product_id, size, color, quantity in lines:
+            quantities[product_id] += quantity
+        if not quantities:
+            return
+        
+        variants, products_with_variants = OrderService.match_variants(
+            [(product_id, size, color) for product_id, size, color, quantity in lines]
+        )
+        variant_quantities = defaultdict(int)
+        for product_id, size, color, quantity in lines:
+            variant = variants.get((product_id, size, color))
+            if variant is not None:
+                variant_quantities[variant.pk] += quantity
+        if variant_quantities:
+            ProductVariant.objects.filter(id__in=variant_quantities.keys()).update(
+                stock=Case(
+                    *[When(id=variant_id, then=F('stock') + quantity) for variant_id, quantity in variant_quantities.items()],
+                    default=F('stock'),
+                    output_field=PositiveIntegerField()
+                )
+            )
+        
+        Product.objects.filter(id__in=quantities.keys()).update(
+            stock_quantity=Case(
+                *[When(id=product_id, then=F('stock_quantity') + quantity) for product_id, quantity in quantities.items()],
+                default=F('stock_quantity'),
+                output_field=PositiveIntegerField()
+            )
+        )
+        brand_ids = Product.objects.filter(id__in=quantities.keys()).values_list('brand_id', flat=True).distinct()
+        scopes = ['catalog', *[f"brand:{brand_id}" for brand_id in brand_ids], *[f"product:{product_id}" for product_id in quantities]]
+        transaction.on_commit(lambda: CatalogCacheService.bump_version(*scopes))
+
+
+class OrderEventService:
+    """Outbox for order side effects, processed by `manage.py run_order_worker`"""
+    
+    WAKEUP_KEY = 'orders:outbox:wakeup'
+    LOCK_SECONDS = 300  # A worker that dies mid-event releases it after this long
+    
+    @staticmethod
+    def enqueue(order, event_type):
+        """Record an event in the current transaction and wake the worker once it commits"""
+        from django.db import transaction
+        from .models import OrderEvent
+        
+        event = OrderEvent.objects.create(
+            order=order,
+            event_type=event_type,
+            # Cancellations are not printed; printing may be switched off entirely
+            print_status='pending' if event_type == 'placed' and settings.ENABLE_AUTO_PRINT else 'skipped',
+        )
+        transaction.on_commit(OrderEventService.wake_worker)
+        return event
+    
+    @staticmethod
+    def wake_worker():
+        """Tell a sleeping worker that new events are waiting"""
+        try:
+            cache.set(OrderEventService.WAKEUP_KEY, time.time(), 3600)
+        except Exception as e:
+            logger.warning(f"Could not wake the order worker: {str(e)}")
+    
+    @staticmethod
+    def consume_wakeup():
+        """Check and clear the wake-up flag"""
+        if cache.get(OrderEventService.WAKEUP_KEY) is None:
+            return False
+        cache.delete(OrderEventService.WAKEUP_KEY)
+        return True
+    
+    @staticmethod
+    def get_handlers(event_type):
+        """Side effect per channel for an event type"""
+        if event_type == 'cancelled':
+            return {
+                'file': FileService.save_cancellation_to_file,
+                'telegram': TelegramService.send_cancellation_notification,
+                'print': None,
+            }
+        return {
+            'file': FileService.save_order_to_file,
+            'telegram': TelegramService.send_order_notification,
+            'print': PrintService.print_order,
+        }
+    
+    @staticmethod
+    def claim_due_events(limit=10):
+        """Lock a batch of due events for this worker"""
+        from django.db import transaction
+        from django.db.models import Q
+        from datetime import timedelta
+        from .models import OrderEvent
+        
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                OrderEvent.objects.select_for_update(skip_locked=True).filter(
+                    completed_at__isnull=True,
+                    next_attempt_at__lte=now
+                ).filter(
+                    Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+                ).order_by('next_attempt_at')[:limit]
+            )
+            OrderEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                locked_until=now + timedelta(seconds=OrderEventService.LOCK_SECONDS)
+            )
+        return events
+    
+    @staticmethod
+    def process_event(event):
+        """Run the pending channels of an event and schedule a retry for failures"""
+        from datetime import timedelta
+        from .models import Order
+        
+        order = Order.objects.select_related('customer').get(pk=event.order_id)
+        handlers = OrderEventService.get_handlers(event.event_type)
+        errors = []
+        
+        for channel in event.get_pending_channels():
+            handler = handlers.get(channel)
+            if handler is None:
+                setattr(event, f'{channel}_status', 'skipped')
+                continue
+            try:
+                succeeded, error = bool(handler(order)), 'failed'
+            except Exception as e:
+                succeeded, error = False, str(e)
+            if succeeded:
+                setattr(event, f'{channel}_status', 'done')
+            else:
+                errors.append(f"{channel}: {error}")
+        
+        event.attempts += 1
+        event.last_error = '\n'.join(errors)
+        event.locked_until = None
+        
+        max_attempts = getattr(settings, 'ORDER_EVENT_MAX_ATTEMPTS', 8)
+        if not event.get_pending_channels():
+            event.completed_at = timezone.now()
+        elif event.attempts >= max_attempts:
+            for channel in event.get_pending_channels():
+                setattr(event, f'{channel}_status', 'failed')
+            event.completed_at = timezone.now()
+            logger.error(f"Order event {event.pk} for order {order.order_id} gave up after {event.attempts} attempts: {event.last_error}")
+        else:
+            # Exponential backoff: 30s, 1m, 2m, 4m ... capped at one hour
+            delay = min(getattr(settings, 'ORDER_EVENT_RETRY_DELAY', 30) * 2 ** (event.attempts - 1), 3600)
+            event.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            logger.warning(f"Order event {event.pk} for order {order.order_id} will retry in {delay}s: {event.last_error}")
+        
+        event.save()
+        return event
+    
+    @staticmethod
+    def process_due_events(limit=10):
+        """Claim and process one batch; returns the number of events handled"""
+        events = OrderEventService.claim_due_events(limit)
+        for event in events:
+            try:
+                OrderEventService.process_event(event)
+            except Exception as e:
+                logger.error(f"Processing order event {event.pk} failed: {str(e)}")
+        return len(events)
+
+
+class ImageService:
+    """Image processing service for resized image variants (WebP + JPEG)"""
+    
+    VARIANT_SIZES = (80, 240, 480, 960)  # Longest side in pixels
+    VARIANT_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+    THUMBNAIL_SIZE = 240  # Used for cart and order rows
+    
+    @staticmethod
+    def get_variant_name(image_name, size, extension):
+        """Get the storage path of one variant of an image path"""
+        base, _ = os.path.splitext(image_name)
+        return f"thumbnails/{base}_{size}.{extension}"
+    
+    @staticmethod
+    def render_variants(image_name):
+        """
+        Generate every size/format variant of a stored image.
+        Only touches storage (no database access) so it can run in worker processes.
+        """
+        from io import BytesIO
+        from PIL import Image, ImageOps
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        
+        sizes = {}
+        with default_storage.open(image_name, 'rb') as source:
+            original = ImageOps.exif_transpose(Image.open(source))
+            original.load()
+        
+        has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+        
+        for size in ImageService.VARIANT_SIZES:
+            resized = original.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)  # Never upscales
+            entry = {'width': resized.width, 'height': resized.height}
+            
+            for extension, image_format in ImageService.VARIANT_FORMATS:
+                output = resized
+                if image_format == 'JPEG' and has_alpha:
+                    # JPEG has no transparency - flatten logos onto white
+                    output = Image.new('RGB', resized.size, (255, 255, 255))
+                    output.paste(resized, mask=resized.split()[-1])
+                
+                buffer = BytesIO()
+                output.save(buffer, image_format, quality=82, optimize=True)
+                
+                # Overwrite any previous variant so the path stays predictable
+                variant_name = ImageService.get_variant_name(image_name, size, extension)
+                if default_storage.exists(variant_name):
+                    default_storage.delete(variant_name)
+                entry[extension] = default_storage.save(variant_name, ContentFile(buffer.getvalue()))
+            
+            sizes[str(size)] = entry
+        
+        return {'source': image_name, 'sizes': sizes}
+    
+    @staticmethod
+    def variants_are_current(variants, image_name):
+        """Check if stored variants were generated from the current image"""
+        return bool(variants) and variants.get('source') == image_name
+    
+    @staticmethod
+    def get_variant_path(variants, size=THUMBNAIL_SIZE, extension='jpg'):
+        """Get the storage path of one variant, or '' if it was not generated"""
+        if not variants:
+            return ''
+        return variants.get('sizes', {}).get(str(size), {}).get(extension, '')
+    
+    @staticmethod
+    def ensure_variants(instance, image_field, variants_field, force=False):
+        """
+        Generate the variants of instance.<image_field> into instance.<variants_field>
+        if they are missing or stale. Returns True when variants were regenerated.
+        """
+        image = getattr(instance, image_field)
+        if not image:
+            if not getattr(instance, variants_field):
+                return False
+            variants = {}
+        elif not force and ImageService.variants_are_current(getattr(instance, variants_field), image.name):
+            return False
+        else:
+            try:
+                variants = ImageService.render_variants(image.name)
+            except Exception as e:
+                logger.error(f"Image variant generation failed for {image.name}: {str(e)}")
+                return False
+        
+        ImageService.save_variants(instance, variants_field, variants)
+        return True
+    
+    @staticmethod
+    def save_variants(instance, variants_field, variants):
+        """Store generated variants on an instance without re-triggering post_save"""
+        from .models import ProductImage
+        
+        updates = {variants_field: variants}
+        if isinstance(instance, ProductImage):
+            updates['thumbnail'] = ImageService.get_variant_path(variants)
+        for field, value in updates.items():
+            setattr(instance, field, value)
+        type(instance).objects.filter(pk=instance.pk).update(**updates)
+
+
+class CatalogCacheService:
+    """Versioned cache for rendered catalog pages and template fragments"""
+    
+    VERSION_KEY = 'catalog:version:{scope}'
+    STATS_KEYS = {True: 'catalog:stats:hits', False: 'catalog:stats:misses'}
+    
+    @staticmethod
+    def get_timeout():
+        """Seconds a rendered page or fragment stays cached"""
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600)
+    
+    @staticmethod
+    def get_versions(scopes):
+        """
+        Get the version stamp of each scope ('catalog', 'brand:<id>', 'product:<id>').
+        A missing stamp starts from the current time so entries written before an
+        eviction can never be matched again.
+        """
+        keys = [CatalogCacheService.VERSION_KEY.format(scope=scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        missing = {key: int(time.time() * 1000) for key in keys if key not in versions}
+        if missing:
+            cache.set_many(missing, None)
+            versions.update(missing)
+        return [versions[key] for key in keys]
+    
+    @staticmethod
+    def bump_version(*scopes):
+        """Invalidate every cached page and fragment built from these scopes"""
+        for scope in scopes:
+            key = CatalogCacheService.VERSION_KEY.format(scope=scope)
+            try:
+                cache.incr(key)
+                cache.touch(key, None)  # File/database backends reset the timeout on incr
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), None)
+    
+    @staticmethod
+    def get_product_scopes(product_id):
+        """Scopes of a product page: the product plus its brand (related products, colors)"""
+        key = f"catalog:product-brand:{product_id}"
+        brand_id = cache.get(key)
+        if brand_id is None:
+            from .models import Product
+            brand_id = Product.objects.filter(pk=product_id).values_list('brand_id', flat=True).first()
+            cache.set(key, brand_id, CatalogCacheService.get_timeout())
+        return [f"product:{product_id}", f"brand:{brand_id}"]
+    
+    @staticmethod
+    def make_key(name, request, scopes):
+        """Build a cache key from the language, the scope versions and the query string"""
+        versions = '.'.join(str(version) for version in CatalogCacheService.get_versions(scopes))
+        query = urlencode(sorted(request.GET.lists()), doseq=True) if request is not None else ''
+        digest = hashlib.md5(f"{versions}|{query}".encode('utf-8')).hexdigest()
+        return f"catalog:{name}:{translation.get_language()}:{digest}"
+    
+    @staticmethod
+    def record(hit):
+        """Count a cache hit or miss for the analytics dashboard"""
+        key = CatalogCacheService.STATS_KEYS[hit]
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, None)
+            cache.incr(key)
+    
+    @staticmethod
+    def get_stats():
+        """Get hit/miss counters and the hit rate"""
+        counters = cache.get_many(CatalogCacheService.STATS_KEYS.values())
+        hits = counters.get(CatalogCacheService.STATS_KEYS[True], 0)
+        misses = counters.get(CatalogCacheService.STATS_KEYS[False], 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits * 100 / total, 1) if total else 0,
+        }
+    
+    @staticmethod
+    def is_cacheable_request(request):
+        """Only anonymous GET requests without a cart or pending messages share pages"""
+        if request.method != 'GET' or request.user.is_authenticated:
+            return False
+        if CartService.get_cart_count(request):
+            return False
+        return not len(messages.get_messages(request))
+    
+    @staticmethod
+    def is_cacheable_response(request, response):
+        """Skip error pages, redirects and pages that displayed messages"""
+        if response.status_code != 200 or response.streaming:
+            return False
+        storage = getattr(request, '_messages', None)
+        return not (storage and storage.used)
+    
+    @staticmethod
+    def cache_page(name, scopes, on_hit=None):
+        """
+        Cache the full rendered page for anonymous visitors.
+        
+        scopes is called with the view arguments and returns the version scopes of the
+        page; on_hit runs on every cache hit (e.g. to keep counting product views).
+        """
+        def decorator(view_func):
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                if not CatalogCacheService.is_cacheable_request(request):
+                    return view_func(request, *args, **kwargs)
+                
+                key = CatalogCacheService.make_key(f"page:{name}", request, scopes(request, *args, **kwargs))
+                cached = cache.get(key)
+                if cached is not None:
+                    CatalogCacheService.record(True)
+                    get_token(request)  # Cached pages read the CSRF token from the cookie
+                    if on_hit:
+                        on_hit(request, *args, **kwargs)
+                    content, content_type = cached
+                    return HttpResponse(content, content_type=content_type)
+                
+                CatalogCacheService.record(False)
+                response = view_func(request, *args, **kwargs)
+                if CatalogCacheService.is_cacheable_response(request, response):
+                    cache.set(key, (response.content, response['Content-Type']), CatalogCacheService.get_timeout())
+                return response
+            return wrapper
+        return decorator
+
+
+class CacheHealthService:
+    """Health check and usage statistics for the configured cache backend"""
+    
+    @staticmethod
+    def get_backend_stats():
+        """Backend specific numbers (entries, size, Redis server counters)"""
+        from django.core.cache.backends.db import DatabaseCache
+        from django.core.cache.backends.filebased import FileBasedCache
+        from django.core.cache.backends.locmem import LocMemCache
+        
+        backend = caches['default']  # The real backend behind the `cache` proxy
+        if isinstance(backend, FileBasedCache):
+            files = [entry for entry in os.scandir(backend._dir) if entry.name.endswith(backend.cache_suffix)] if os.path.isdir(backend._dir) else []
+            return {
+                'entries': len(files),
+                'size_bytes': sum(entry.stat().st_size for entry in files),
+            }
+        if isinstance(backend, DatabaseCache):
+            from django.db import connections, router
+            db = router.db_for_read(backend.cache_model_class)
+            connection = connections[db]
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(backend._table)}")
+                return {'entries': cursor.fetchone()[0]}
+        if isinstance(backend, LocMemCache):
+            return {'entries': len(backend._cache)}
+        if hasattr(backend, '_cache') and hasattr(backend._cache, 'get_client'):
+            info = backend._cache.get_client().info()
+            return {
+                'redis_version': info.get('redis_version'),
+                'used_memory': info.get('used_memory_human'),
+                'connected_clients': info.get('connected_clients'),
+                'keyspace_hits': info.get('keyspace_hits'),
+                'keyspace_misses': info.get('keyspace_misses'),
+                'evicted_keys': info.get('evicted_keys'),
+            }
+        return {}
+    
+    @staticmethod
+    def check():
+        """Round-trip a probe key and collect statistics"""
+        config = settings.CACHES['default']
+        report = {
+            'backend': getattr(settings, 'CACHE_BACKEND', None),
+            'class': config['BACKEND'],
+            'key_prefix': config.get('KEY_PREFIX', ''),
+            'version': config.get('VERSION', 1),
+            'healthy': False,
+        }
+        
+        probe_key = f"health:{uuid.uuid4().hex}"
+        started = time.perf_counter()
+        try:
+            cache.set(probe_key, 'ok', 30)
+            report['healthy'] = cache.get(probe_key) == 'ok'
+            cache.delete(probe_key)
+        except Exception as e:
+            logger.error(f"Cache health check failed: {str(e)}")
+            report['error'] = str(e)
+        report['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        
+        if report['healthy']:
+            try:
+                report['catalog'] = CatalogCacheService.get_stats()
+                report['stats'] = CacheHealthService.get_backend_stats()
+            except Exception as e:
+                logger.error(f"Error collecting cache statistics: {str(e)}")
+                report['stats_error'] = str(e)
+        
+        return report
+
+
+class SearchIndexService:
+    """
+    In-process prefix/trigram index of product names (Arabic, English, Hebrew)
+    and brand names for search suggestions.
+    
+    Each worker process builds its own copy in a background thread on first
+    use and serves suggestions from the database until it is ready. Signals
+    update it incrementally and bump the 'search' version, which makes other
+    processes rebuild; stock and other catalog changes do not.
+    
+    Published indexes are never modified: updates copy the containers they
+    touch and swap in a new index, so readers need no lock.
+    """
+    
+    MAX_PREFIX = 20
+    REBUILD_INTERVAL = 30  # Minimum seconds between rebuilds caused by other processes
+    VERSION_SCOPE = 'search'
+    # Product columns shown or searched in suggestions; saves touching only others are ignored
+    INDEXED_FIELDS = {
+        'name', 'name_en', 'name_he', 'brand', 'is_active', 'price', 'is_featured',
+        'main_image', 'main_thumbnail',
+    }
+    
+    # Arabic diacritics, Quranic marks and tatweel; Hebrew cantillation and niqqud
+    _STRIP_RE = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640\u0591-\u05C7]')
+    _TOKEN_RE = re.compile(r'\w+')
+    _CHAR_MAP = str.maketrans({
+        'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+        'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+        # Hebrew final letters, so a half-typed word still matches
+        'ך': 'כ', 'ם': 'מ', 'ן': 'נ', 'ף': 'פ', 'ץ': 'צ',
+    })
+    
+    _index = None
+    _building = False
+    _last_build = 0
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text):
+        """Lowercase and fold Arabic/Hebrew spelling variants"""
+        text = SearchIndexService._STRIP_RE.sub('', (text or '').lower())
+        return ' '.join(text.translate(SearchIndexService._CHAR_MAP).split())
+    
+    @staticmethod
+    def _make_entry(product):
+        """Searchable fields and the suggestion payload of one product"""
+        from django.core.files.storage import default_storage
+        
+        names = [product['name'], product['name_en'], product['name_he']]
+        brands = [product['brand__name'], product['brand__name_en'], product['brand__name_he']]
+        normalized_names = [SearchIndexService.normalize(name) for name in names if name]
+        normalized_brands = [SearchIndexService.normalize(name) for name in brands if name]
+        thumbnail = product['main_thumbnail'] or product['main_image']
+        return {
+            'names': normalized_names,
+            'text': ' '.join(normalized_names + normalized_brands),
+            'is_featured': product['is_featured'],
+            'suggestion': {
+                'id': product['id'],
+                'name': product['name'],
+                'brand': product['brand__name'],
+                'price': str(product['price']),
+                'image': default_storage.url(thumbnail) if thumbnail else None,
+                'url': f"/product/{product['id']}/",
+            },
+        }
+    
+    @staticmethod
+    def _fetch(**filters):
+        from .models import Product
+        
+        return Product.objects.filter(is_active=True, **filters).values(
+            'id', 'name', 'name_en', 'name_he', 'price', 'is_featured', 'main_image', 'main_thumbnail',
+            'brand__name', 'brand__name_en', 'brand__name_he'
+        )
+    
+    @staticmethod
+    def _keys(text):
+        """(kind, key) of every prefix and trigram of a text"""
+        keys = set()
+        for token in set(SearchIndexService._TOKEN_RE.findall(text)):
+            for length in range(1, min(len(token), SearchIndexService.MAX_PREFIX) + 1):
+                keys.add(('prefixes', token[:length]))
+            for position in range(len(token) - 2):
+                keys.add(('trigrams', token[position:position + 3]))
+        return keys
+    
+    @staticmethod
+    def _bucket(index, kind, key, copied):
+        """
+        Id set of a key. While updating a published index (copied is a set)
+        each set is copied on first touch, so readers never see it change.
+        """
+        if copied is None:
+            return index[kind].setdefault(key, set())
+        if (kind, key) not in copied:
+            index[kind][key] = set(index[kind].get(key, ()))
+            copied.add((kind, key))
+        return index[kind][key]
+    
+    @staticmethod
+    def _add(index, entry, copied=None):
+        product_id = entry['suggestion']['id']
+        index['entries'][product_id] = entry
+        for kind, key in SearchIndexService._keys(entry['text']):
+            SearchIndexService._bucket(index, kind, key, copied).add(product_id)
+    
+    @staticmethod
+    def _discard(index, product_id, copied=None):
+        entry = index['entries'].pop(product_id, None)
+        if entry is None:
+            return
+        for kind, key in SearchIndexService._keys(entry['text']):
+            if key in index[kind]:
+                SearchIndexService._bucket(index, kind, key, copied).discard(product_id)
+    
+    @staticmethod
+    def _copy(index):
+        """Shallow copy of an index for an update; the id sets are copied as they are touched"""
+        return {
+            'entries': dict(index['entries']),
+            'prefixes': dict(index['prefixes']),
+            'trigrams': dict(index['trigrams']),
+            'version': index['version'],
+        }
+    
+    @staticmethod
+    def build():
+        """Build a fresh index and swap it in"""
+        started = time.perf_counter()
+        version = CatalogCacheService.get_versions([SearchIndexService.VERSION_SCOPE])[0]
+        index = {'entries': {}, 'prefixes': {}, 'trigrams': {}, 'version': version}
+        for product in SearchIndexService._fetch():
+            SearchIndexService._add(index, SearchIndexService._make_entry(product))
+        with SearchIndexService._lock:
+            SearchIndexService._index = index
+            SearchIndexService._last_build = time.monotonic()
+        logger.info(f"Search index built with {len(index['entries'])} products in {(time.perf_counter() - started) * 1000:.0f}ms")
+    
+    @staticmethod
+    def build_in_background():
+        """Start a rebuild unless one is already running"""
+        with SearchIndexService._lock:
+            if SearchIndexService._building:
+                return
+            SearchIndexService._building = True
+        
+        def run():
+            from django.db import close_old_connections
+            try:
+                SearchIndexService.build()
+            except Exception as e:
+                logger.error(f"Building search index failed: {str(e)}")
+            finally:
+                SearchIndexService._building = False
+                close_old_connections()
+        
+        threading.Thread(target=run, name='search-index', daemon=True).start()
+    
+    @staticmethod
+    def get_index():
+        """The ready index, or None while it is cold"""
+        index = SearchIndexService._index
+        if index is None:
+            SearchIndexService.build_in_background()
+            return None
+        if time.monotonic() - SearchIndexService._last_build > SearchIndexService.REBUILD_INTERVAL:
+            if CatalogCacheService.get_versions([SearchIndexService.VERSION_SCOPE])[0] != index['version']:
+                SearchIndexService.build_in_background()
+        return index
+    
+    @staticmethod
+    def update_products(**filters):
+        """Re-index matching products (signal handlers) and tell other processes to rebuild"""
+        CatalogCacheService.bump_version(SearchIndexService.VERSION_SCOPE)
+        if SearchIndexService._index is None:
+            return
+        from .models import Product
+        
+        rows = {product['id']: product for product in SearchIndexService._fetch(**filters)}
+        product_ids = set(Product.objects.filter(**filters).values_list('id', flat=True))
+        with SearchIndexService._lock:
+            index = SearchIndexService._copy(SearchIndexService._index)
+            copied = set()
+            for product_id in product_ids:
+                SearchIndexService._discard(index, product_id, copied)
+                if product_id in rows:
+                    SearchIndexService._add(index, SearchIndexService._make_entry(rows[product_id]), copied)
+            # Our own change bumped the version - do not rebuild for it
+            index['version'] = CatalogCacheService.get_versions([SearchIndexService.VERSION_SCOPE])[0]
+            SearchIndexService._index = index
+    
+    @staticmethod
+    def remove_product(product_id):
+        """Drop a deleted product from the index"""
+        CatalogCacheService.bump_version(SearchIndexService.VERSION_SCOPE)
+        if SearchIndexService._index is None:
+            return
+        with SearchIndexService._lock:
+            index = SearchIndexService._copy(SearchIndexService._index)
+            SearchIndexService._discard(index, product_id, set())
+            index['version'] = CatalogCacheService.get_versions([SearchIndexService.VERSION_SCOPE])[0]
+            SearchIndexService._index = index
+    
+    @staticmethod
+    def search(query, limit=10):
+        """Ranked suggestions, or None when the index is not ready yet"""
+        index = SearchIndexService.get_index()
+        if index is None:
+            return None
+        
+        normalized = SearchIndexService.normalize(query)
+        tokens = SearchIndexService._TOKEN_RE.findall(normalized)
+        if not tokens:
+            return []
+        
+        # Every query word must match the start of a word, or appear inside one
+        entries = index['entries']
+        matches = None
+        for token in tokens:
+            ids = set(index['prefixes'].get(token, ())) if len(token) <= SearchIndexService.MAX_PREFIX else set()
+            if not ids and len(token) >= 3:
+                trigram_sets = [index['trigrams'].get(token[i:i + 3], set()) for i in range(len(token) - 2)]
+                ids = {product_id for product_id in set.intersection(*trigram_sets) if token in entries[product_id]['text']}
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        
+        ranked = []
+        for product_id in matches:
+            entry = entries[product_id]
+            points = 0
+            if normalized in entry['names']:
+                points += 100
+            elif any(name.startswith(normalized) for name in entry['names']):
+                points += 60
+            elif normalized in entry['text']:
+                points += 30
+            if entry['is_featured']:
+                points += 5
+            ranked.append((-points, entry['suggestion']['name'], entry['suggestion']))
+        ranked.sort(key=lambda row: (row[0], row[1]))
+        return [row[2] for row in ranked[:limit]]
+
+
+class FacetService:
+    """Filter counts for the products page, computed in two grouped queries"""
+    
+    # [min, max) price buckets in store currency; None means open-ended
+    PRICE_BUCKETS = ((0, 200), (200, 350), (350, 500), (500, None))
+    # Smallest price step (Product.price has two decimals); the bucket shortcut
+    # fills max_price one step below the bound, since the filter compares with lte
+    PRICE_STEP = Decimal('0.01')
+    
+    @staticmethod
+    def get_price_bucket_expression(field='price'):
+        """CASE expression numbering the price bucket of a product"""
+        from django.db.models import Case, IntegerField, Value, When
+        
+        whens = []
+        for index, (low, high) in enumerate(FacetService.PRICE_BUCKETS):
+            if high is not None:
+                whens.append(When(**{f'{field}__lt': high}, then=Value(index)))
+        return Case(*whens, default=Value(len(FacetService.PRICE_BUCKETS) - 1), output_field=IntegerField())
+    
+    @staticmethod
+    def parse_filters(filters):
+        """Normalize the products view filters into the values the facets compare against"""
+        brand_ids = set()
+        for brand_id in filters.get('brand') or []:
+            try:
+                brand_ids.add(int(brand_id))
+            except (ValueError, TypeError):
+                pass
+        prices = {}
+        for key in ('min_price', 'max_price'):
+            try:
+                prices[key] = Decimal(filters[key]) if filters.get(key) else None
+            except (ArithmeticError, ValueError, TypeError):
+                prices[key] = None
+        return {
+            'search': filters.get('search') or '',
+            'brand': brand_ids,
+            'color': filters.get('color') or '',
+            'size': filters.get('size') or '',
+            **prices,
+        }
+    
+    @staticmethod
+    def get_facets(filters):
+        """
+        Counts per brand, color, size and price bucket for the current filters.
+        
+        Each facet ignores its own filter, so the counts show what selecting
+        another value would return. Cached per filter combination until the
+        catalog changes.
+        """
+        parsed = FacetService.parse_filters(filters)
+        versions = '.'.join(str(version) for version in CatalogCacheService.get_versions(['catalog']))
+        combination = repr(sorted((key, sorted(value) if isinstance(value, set) else str(value)) for key, value in parsed.items()))
+        key = f"catalog:facets:{versions}:{hashlib.md5(combination.encode('utf-8')).hexdigest()}"
+        
+        facets = cache.get(key)
+        if facets is None:
+            facets = FacetService.compute(parsed)
+            cache.set(key, facets, CatalogCacheService.get_timeout())
+        return facets
+    
+    @staticmethod
+    def compute(parsed):
+        """Run the grouped queries and fold the rows into per-facet counts"""
+        from collections import Counter
+        from django.db.models import BooleanField, Q, Value
+        from .models import Product, ProductQuerySet, ProductVariant
+        
+        # Only the search narrows the base set; every other filter becomes a group column
+        products = Product.objects.filter(is_active=True)
+        if parsed['search']:
+            products = products.search(parsed['search'])
+        
+        def in_price(prefix=''):
+            condition = Q()
+            if parsed['min_price'] is not None:
+                condition &= Q(**{f'{prefix}price__gte': parsed['min_price']})
+            if parsed['max_price'] is not None:
+                condition &= Q(**{f'{prefix}price__lte': parsed['max_price']})
+            return ExpressionWrapper(condition, output_field=BooleanField()) if condition else Value(True)
+        
+        has_size = ExpressionWrapper(
+            ProductQuerySet.size_q(parsed['size']), output_field=BooleanField()
+        ) if parsed['size'] else Value(True)
+        
+        product_rows = products.order_by().annotate(
+            bucket=FacetService.get_price_bucket_expression(),
+            in_price=in_price(),
+            has_size=has_size,
+        ).values('brand_id', 'color', 'bucket', 'in_price', 'has_size').annotate(count=Count('id', distinct=True))
+        
+        size_rows = ProductVariant.objects.filter(
+            stock__gt=0, product__in=products.values('id')
+        ).order_by().annotate(
+            in_price=in_price('product__'),
+        ).values('size', 'product__brand_id', 'product__color', 'in_price').annotate(count=Count('product_id', distinct=True))
+        
+        def brand_ok(brand_id):
+            return not parsed['brand'] or brand_id in parsed['brand']
+        
+        def color_ok(color):
+            return not parsed['color'] or color == parsed['color']
+        
+        brands, colors, buckets, sizes = Counter(), Counter(), Counter(), Counter()
+        for row in product_rows:
+            if color_ok(row['color']) and row['in_price'] and row['has_size']:
+                brands[row['brand_id']] += row['count']
+            if brand_ok(row['brand_id']) and row['in_price'] and row['has_size']:
+                colors[row['color']] += row['count']
+            if brand_ok(row['brand_id']) and color_ok(row['color']) and row['has_size']:
+                buckets[row['bucket']] += row['count']
+        for row in size_rows:
+            if brand_ok(row['product__brand_id']) and color_ok(row['product__color']) and row['in_price']:
+                sizes[row['size']] += row['count']
+        # Products without variants list their sizes on the product
+        legacy_rows = products.without_variants().filter(stock_quantity__gt=0).order_by().annotate(
+            in_price=in_price(),
+        ).values_list('brand_id', 'color', 'in_price', 'sizes')
+        for brand_id, color, price_ok, product_sizes in legacy_rows:
+            if brand_ok(brand_id) and color_ok(color) and price_ok:
+                for size in {str(size) for size in product_sizes or []}:
+                    sizes[size] += 1
+        
+        return {
+            'brands': dict(brands),
+            'colors': dict(colors),
+            'sizes': dict(sizes),
+            'prices': [
+                {
+                    'min': low, 'max': high, 'count': buckets.get(index, 0),
+                    'max_price': high - FacetService.PRICE_STEP if high is not None else None,
+                }
+                for index, (low, high) in enumerate(FacetService.PRICE_BUCKETS)
+            ],
+        }
+
+
+class ViewCounterService:
+    """
+    Product view counts buffered outside the database and flushed in batches.
+    
+    With the redis cache the buffer is one shared hash (product id -> pending
+    views) updated with HINCRBY, so it is atomic across workers and the hash
+    fields are exactly the products to flush. Other backends cannot increment
+    atomically across processes, so each worker keeps its own counters in
+    memory and flushes them itself.
+    
+    Pending views are subtracted only after the UPDATE has committed; views
+    counted in between, or a failed UPDATE, stay in the buffer.
+    
+    A worker flushes its in-memory counters on its next view after the
+    interval, and at exit. A worker that is killed (SIGKILL, OOM, crash)
+    loses the views it had not flushed yet.
+    """
+    
+    PENDING_KEY = 'views:pending'
+    FLUSH_LOCK_KEY = 'views:flush-lock'
+    
+    # Subtract the written counts and drop the products that reach zero, atomically
+    SUBTRACT_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+    
+    # User agents that are not shoppers (crawlers, link previews, scripts, monitors)
+    BOT_RE = re.compile(
+        r'bot|crawl|spider|slurp|archiver|facebookexternalhit|whatsapp|telegram|preview|'
+        r'monitor|pingdom|uptime|lighthouse|headless|phantom|curl|wget|python-|java/|go-http|httpclient',
+        re.IGNORECASE
+    )
+    
+    _local_counts = {}
+    _local_lock = threading.Lock()
+    _local_last_flush = time.monotonic()
+    _local_exit_hook = False
+    
+    @staticmethod
+    def get_flush_interval():
+        return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 60)
+    
+    @staticmethod
+    def get_redis_client():
+        """Raw client of the redis cache, or None when another backend is configured"""
+        from django.core.cache.backends.redis import RedisCache
+        
+        backend = caches['default']  # The real backend behind the `cache` proxy
+        if isinstance(backend, RedisCache):
+            return backend._cache.get_client(write=True)
+        return None
+    
+    @staticmethod
+    def is_bot(request):
+        """Skip crawlers, prefetches and requests without a user agent"""
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        if not user_agent or ViewCounterService.BOT_RE.search(user_agent):
+            return True
+        purpose = request.META.get('HTTP_SEC_PURPOSE') or request.META.get('HTTP_PURPOSE') or ''
+        return 'prefetch' in purpose.lower()
+    
+    @staticmethod
+    def record(request, product_id):
+        """Count one product view; flushes the buffer when the interval has passed"""
+        if request.method != 'GET' or ViewCounterService.is_bot(request):
+            return
+        try:
+            client = ViewCounterService.get_redis_client()
+            interval = ViewCounterService.get_flush_interval()
+            if client is not None:
+                client.hincrby(cache.make_key(ViewCounterService.PENDING_KEY), product_id, 1)
+                # add() succeeds for one worker per interval, which then writes the batch
+                due = cache.add(ViewCounterService.FLUSH_LOCK_KEY, 1, interval)
+            else:
+                with ViewCounterService._local_lock:
+                    counts = ViewCounterService._local_counts
+                    counts[product_id] = counts.get(product_id, 0) + 1
+                    if not ViewCounterService._local_exit_hook:
+                        atexit.register(ViewCounterService.flush_at_exit)
+                        ViewCounterService._local_exit_hook = True
+                    due = time.monotonic() - ViewCounterService._local_last_flush >= interval
+                    if due:
+                        ViewCounterService._local_last_flush = time.monotonic()
+            if due:
+                ViewCounterService.flush()
+        except Exception as e:
+            logger.error(f"View count record failed: {str(e)}")
+    
+    @staticmethod
+    def flush_at_exit():
+        """Write this worker's in-memory counters when the process shuts down"""
+        with ViewCounterService._local_lock:
+            if not ViewCounterService._local_counts:
+                return
+        try:
+            ViewCounterService.flush()
+        except Exception as e:
+            logger.error(f"View count flush at exit failed: {str(e)}")
+    
+    @staticmethod
+    def get_pending():
+        """Buffered views per product id"""
+        client = ViewCounterService.get_redis_client()
+        if client is not None:
+            pending = client.hgetall(cache.make_key(ViewCounterService.PENDING_KEY))
+            return {int(product_id): int(count) for product_id, count in pending.items() if int(count) > 0}
+        with ViewCounterService._local_lock:
+            return dict(ViewCounterService._local_counts)
+    
+    @staticmethod
+    def subtract(pending):
+        """Remove written views from the buffer, keeping views counted meanwhile"""
+        client = ViewCounterService.get_redis_client()
+        if client is not None:
+            args = [value for product_id, count in pending.items() for value in (product_id, count)]
+            client.eval(ViewCounterService.SUBTRACT_SCRIPT, 1, cache.make_key(ViewCounterService.PENDING_KEY), *args)
+            return
+        with ViewCounterService._local_lock:
+            counts = ViewCounterService._local_counts
+            for product_id, count in pending.items():
+                remaining = counts.get(product_id, 0) - count
+                if remaining > 0:
+                    counts[product_id] = remaining
+                else:
+                    counts.pop(product_id, None)
+    
+    @staticmethod
+    def flush():
+        """Write the buffered counts with one UPDATE; returns the number of views written"""
+        from django.db import transaction
+        from django.db.models import Case, PositiveIntegerField, When
+        from .models import Product
+        
+        pending = ViewCounterService.get_pending()
+        if not pending:
+            return 0
+        
+        with transaction.atomic():
+            Product.objects.filter(id__in=pending.keys()).update(
+                views_count=Case(
+                    *[When(id=product_id, then=F('views_count') + count) for product_id, count in pending.items()],
+                    default=F('views_count'),
+                    output_field=PositiveIntegerField()
+                )
+            )
+            transaction.on_commit(lambda: ViewCounterService.subtract(pending))
+        total = sum(pending.values())
+        logger.info(f"Flushed {total} product views for {len(pending)} products")
+        return total
+
+
+class RelatedProductService:
+    """
+    Precomputed related-products lists (RelatedProduct rows) scored by
+    co-purchases, shared colors, brand and price proximity.
+    
+    Orders and catalog edits flag products with related_stale; the order
+    worker (or manage.py refresh_related_products) recomputes them.
+    """
+    
+    LIMIT = 8  # Entries stored per product
+    PRICE_WINDOW = 0.3  # Prices within +-30% count as similar
+    WEIGHTS = {
+        'co_purchase': 3.0,
+        'brand': 2.0,
+        'color': 1.0,
+        'price': 1.0,
+    }
+    
+    @staticmethod
+    def mark_stale(condition):
+        """Flag the products matching a Q object for recomputation"""
+        from .models import Product
+        
+        Product.objects.filter(pk__in=Product.objects.filter(condition).values('pk')).update(related_stale=True)
+    
+    @staticmethod
+    def get_color_sets():
+        """Color variant ids per product, from images and stock variants"""
+        from collections import defaultdict
+        from .models import ProductImage, ProductVariant
+        
+        colors = defaultdict(set)
+        for model in (ProductImage, ProductVariant):
+            rows = model.objects.filter(color_variant__isnull=False).values_list('product_id', 'color_variant_id').distinct()
+            for product_id, color_variant_id in rows:
+                colors[product_id].add(color_variant_id)
+        return colors
+    
+    @staticmethod
+    def get_co_purchases(product_ids):
+        """How many (non-cancelled) orders each target product shares with every other product"""
+        from collections import Counter, defaultdict
+        from .models import OrderItem
+        
+        order_ids = OrderItem.objects.filter(product_id__in=product_ids).exclude(order__status='cancelled').values('order_id')
+        products_by_order = defaultdict(set)
+        for order_id, product_id in OrderItem.objects.filter(order_id__in=order_ids).values_list('order_id', 'product_id'):
+            products_by_order[order_id].add(product_id)
+        
+        co_purchases = defaultdict(Counter)
+        targets = set(product_ids)
+        for products in products_by_order.values():
+            for product_id in products & targets:
+                for other_id in products:
+                    if other_id != product_id:
+                        co_purchases[product_id][other_id] += 1
+        return co_purchases
+    
+    @staticmethod
+    def score(product, candidate, co_purchases, colors, max_co_purchases):
+        """Weighted parts of a candidate's score, by reason"""
+        weights = RelatedProductService.WEIGHTS
+        parts = {}
+        
+        bought_together = co_purchases.get(candidate['id'], 0)
+        if bought_together:
+            parts['co_purchase'] = weights['co_purchase'] * bought_together / max_co_purchases
+        
+        own_colors = colors.get(product['id'])
+        shared_colors = own_colors & colors.get(candidate['id'], set()) if own_colors else set()
+        if shared_colors:
+            parts['color'] = weights['color'] * len(shared_colors) / len(own_colors)
+        
+        if candidate['brand_id'] == product['brand_id']:
+            parts['brand'] = weights['brand']
+        
+        if product['price']:
+            difference = abs(float(candidate['price'] - product['price'])) / float(product['price'])
+            if difference <= RelatedProductService.PRICE_WINDOW:
+                parts['price'] = weights['price'] * (1 - difference / RelatedProductService.PRICE_WINDOW)
+        return parts
+    
+    @staticmethod
+    def refresh(product_ids):
+        """Recompute and store the related lists of the given products"""
+        import heapq
+        from django.db import transaction
+        from .models import Product, RelatedProduct
+        
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        # Cleared first, so edits made while computing flag the product again
+        Product.objects.filter(id__in=product_ids).update(related_stale=False)
+        
+        catalog = {
+            product['id']: product
+            for product in Product.objects.filter(is_active=True).values('id', 'brand_id', 'price', 'variant_group')
+        }
+        colors = RelatedProductService.get_color_sets()
+        co_purchases = RelatedProductService.get_co_purchases(product_ids)
+        
+        links = []
+        for product_id in product_ids:
+            product = catalog.get(product_id)
+            if product is None:
+                continue
+            bought_with = co_purchases.get(product_id, {})
+            max_co_purchases = max(bought_with.values(), default=0)
+            
+            scored = []
+            for candidate in catalog.values():
+                # Other colors of the same model are shown as variants, not as related products
+                if candidate['id'] == product_id or candidate['variant_group'] == product['variant_group']:
+                    continue
+                parts = RelatedProductService.score(product, candidate, bought_with, colors, max_co_purchases)
+                if parts:
+                    scored.append((sum(parts.values()), -candidate['id'], max(parts, key=parts.get)))
+            
+            for score, negative_id, reason in heapq.nlargest(RelatedProductService.LIMIT, scored):
+                links.append(RelatedProduct(product_id=product_id, related_id=-negative_id, score=score, reason=reason))
+        
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+            RelatedProduct.objects.bulk_create(links)
+        CatalogCacheService.bump_version(*[f"product:{product_id}" for product_id in product_ids])
+        return len(product_ids)
+    
+    @staticmethod
+    def refresh_stale(limit=50):
+        """Recompute up to `limit` flagged products; returns how many were refreshed"""
+        from .models import Product
+        
+        try:
+            product_ids = list(Product.objects.filter(related_stale=True).values_list('id', flat=True)[:limit])
+            return RelatedProductService.refresh(product_ids)
+        except Exception as e:
+            logger.error(f"Related products refresh failed: {str(e)}")
+            return 0
+
+
+class CatalogSnapshotService:
+    """
+    Compact JSON snapshot of the active catalog for API clients, built once
+    per catalog version and stored pre-serialized and pre-gzipped in the cache.
+    """
+    
+    SNAPSHOT_KEY = 'catalog:snapshot:{version}'
+    DELTA_KEY = 'catalog:snapshot-delta:{since}:{version}'
+    # Old snapshots are kept this long so clients can still ask for a delta
+    TIMEOUT = 24 * 3600
+    
+    @staticmethod
+    def get_version():
+        return CatalogCacheService.get_versions(['catalog'])[0]
+    
+    @staticmethod
+    def make_etag(version, since=None, gzip=False):
+        """Strong ETag: the snapshot bytes only change with the catalog version (and encoding)"""
+        tag = f'catalog-{since}-{version}' if since is not None else f'catalog-{version}'
+        return f'"{tag}-gz"' if gzip else f'"{tag}"'
+    
+    @staticmethod
+    def build_entries():
+        """One entry per active product, keyed by id (three queries in total)"""
+        from collections import defaultdict
+        from django.core.files.storage import default_storage
+        from .models import Product, ProductImage, ProductVariant
+        
+        colors = defaultdict(list)
+        image_colors = ProductImage.objects.filter(product__is_active=True).order_by('product_id', 'order', 'id').values_list(
+            'product_id', 'color_variant__code', 'color'
+        )
+        variant_colors = ProductVariant.objects.filter(product__is_active=True, color_variant__isnull=False).values_list(
+            'product_id', 'color_variant__code'
+        )
+        for product_id, variant_code, legacy_color in image_colors:
+            code = variant_code or legacy_color
+            if code and code not in colors[product_id]:
+                colors[product_id].append(code)
+        for product_id, code in variant_colors:
+            if code not in colors[product_id]:
+                colors[product_id].append(code)
+        
+        entries = {}
+        products = Product.objects.filter(is_active=True).select_related('brand').only(
+            'id', 'name', 'name_en', 'name_he', 'price', 'sizes', 'color', 'stock_quantity',
+            'main_image', 'main_image_variants', 'brand__id', 'brand__name',
+        ).order_by('id')
+        for product in products:
+            variants = {
+                width: {extension: default_storage.url(path) for extension, path in entry.items() if extension in ('jpg', 'webp') and path}
+                for width, entry in (product.main_image_variants or {}).get('sizes', {}).items()
+            }
+            product_colors = colors.get(product.id) or ([product.color] if product.color else [])
+            entries[product.id] = {
+                'id': product.id,
+                'name': {'ar': product.name, 'en': product.name_en, 'he': product.name_he},
+                'brand': {'id': product.brand.id, 'name': product.brand.name},
+                'price': str(product.price),
+                'sizes': product.sizes,
+                'colors': product_colors,
+                'image': product.main_image.url if product.main_image else None,
+                'image_variants': variants,
+                'in_stock': product.stock_quantity > 0,
+            }
+        return entries
+    
+    @staticmethod
+    def serialize(payload):
+        """(JSON bytes, gzipped JSON bytes)"""
+        import gzip
+        
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return body, gzip.compress(body, 6)
+    
+    @staticmethod
+    def get_snapshot(version=None):
+        """Stored snapshot {'version', 'entries', 'body', 'gzip'} for the current catalog version"""
+        version = version or CatalogSnapshotService.get_version()
+        key = CatalogSnapshotService.SNAPSHOT_KEY.format(version=version)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            entries = CatalogSnapshotService.build_entries()
+            body, gzipped = CatalogSnapshotService.serialize({
+                'version': version,
+                'full': True,
+                'products': list(entries.values()),
+            })
+            snapshot = {'version': version, 'entries': entries, 'body': body, 'gzip': gzipped}
+            cache.set(key, snapshot, CatalogSnapshotService.TIMEOUT)
+        return snapshot
+    
+    @staticmethod
+    def get_delta(since, version=None):
+        """
+        Changes since an older snapshot version: changed/added products and
+        removed ids. Returns None when that snapshot is no longer stored.
+        """
+        version = version or CatalogSnapshotService.get_version()
+        key = CatalogSnapshotService.DELTA_KEY.format(since=since, version=version)
+        delta = cache.get(key)
+        if delta is not None:
+            return delta
+        
+        old = cache.get(CatalogSnapshotService.SNAPSHOT_KEY.format(version=since))
+        if old is None:
+            return None
+        current = CatalogSnapshotService.get_snapshot(version)
+        old_entries, entries = old['entries'], current['entries']
+        body, gzipped = CatalogSnapshotService.serialize({
+            'version': version,
+            'since': since,
+            'full': False,
+            'products': [entry for product_id, entry in entries.items() if old_entries.get(product_id) != entry],
+            'removed': [product_id for product_id in old_entries if product_id not in entries],
+        })
+        delta = {'version': version, 'body': body, 'gzip': gzipped}
+        cache.set(key, delta, CatalogSnapshotService.TIMEOUT)
+        return delta
+
+
+class CatalogStatsService:
+    """
+    Catalog-wide numbers the listing pages show on every request (price bounds,
+    active brands with product counts, color and size availability),
+    computed once per catalog version instead of aggregated per request.
+    """
+    
+    STATS_KEY = 'catalog:stats:{version}'
+    
+    @staticmethod
+    def get_stats():
+        version = CatalogCacheService.get_versions(['catalog'])[0]
+        key = CatalogStatsService.STATS_KEY.format(version=version)
+        stats = cache.get(key)
+        if stats is None:
+            stats = CatalogStatsService.compute()
+            cache.set(key, stats, CatalogCacheService.get_timeout())
+        return stats
+    
+    @staticmethod
+    def compute():
+        from collections import Counter
+        from django.db.models import Max, Min, Q
+        from .models import Brand, Product, ProductVariant
+        
+        active = Product.objects.filter(is_active=True)
+        price_range = active.aggregate(min_price=Min('price'), max_price=Max('price'))
+        
+        brands = list(
+            Brand.objects.filter(is_active=True).annotate(
+                product_count=Count('products', filter=Q(products__is_active=True))
+            )
+        )
+        colors = dict(
+            active.filter(stock_quantity__gt=0).exclude(color__isnull=True).exclude(color='')
+            .order_by().values_list('color').annotate(count=Count('id'))
+        )
+        sizes = Counter(dict(
+            ProductVariant.objects.filter(stock__gt=0, product__is_active=True)
+            .order_by().values_list('size').annotate(count=Count('product_id', distinct=True))
+        ))
+        # Products without variants list their sizes on the product
+        for product_sizes in active.without_variants().filter(stock_quantity__gt=0).values_list('sizes', flat=True):
+            sizes.update({str(size) for size in product_sizes or []})
+        return {
+            'price_range': price_range,
+            'brands': brands,
+            'brand_counts': {brand.id: brand.product_count for brand in brands},
+            'colors': colors,
+            'sizes': dict(sizes),
+        }
+
+
 class TranslationService:
     """Translation service using Libre Translate API"""
     
@@ -1204,60 +2752,124 @@ class TranslationService:
         return 'rtl' if language_code in rtl_languages else 'ltr'
 
 
+class CartSummary:
+    """Item count and total of a cart"""
+    
+    def __init__(self, count=0, total=Decimal('0'), lines=0):
+        self.count = count  # Pieces
+        self.total = total
+        self.lines = lines  # Distinct cart rows
+    
+    def __bool__(self):
+        return self.count > 0
+
+
 class CartService:
-    """Cart management service"""
+    """
+    Cart management service.
+    
+    Both carts live in CartItem rows: signed-in users by user, guests by
+    session key. Reading a cart never writes the session.
+    """
+    
+    SUMMARY_TIMEOUT = 60 * 60
+    
+    @staticmethod
+    def get_owner_filter(request, create=False):
+        """Lookup for the current cart, or None for a guest without a session yet"""
+        if request.user.is_authenticated:
+            return {'user': request.user}
+        if not request.session.session_key:
+            if not create:
+                return None
+            request.session.create()
+        if 'cart' in request.session:
+            CartService.import_session_cart(request)
+        return {'user': None, 'session_key': request.session.session_key}
+    
+    @staticmethod
+    def import_session_cart(request):
+        """Move a cart stored in the session by older versions into CartItem rows"""
+        from .models import Product, CartItem
+        
+        session_cart = request.session.pop('cart', None) or {}
+        products = Product.objects.filter(
+            id__in=[item.get('product_id') for item in session_cart.values()]
+        ).in_bulk()
+        for item_data in session_cart.values():
+            product = products.get(item_data.get('product_id'))
+            if not product:
+                continue
+            cart_item, created = CartItem.objects.get_or_create(
+                user=None,
+                session_key=request.session.session_key,
+                product=product,
+                size=item_data.get('size', ''),
+                color=item_data.get('color') or None,
+                defaults={'quantity': item_data.get('quantity', 1)}
+            )
+            if not created:
+                cart_item.quantity += item_data.get('quantity', 1)
+                cart_item.save()
+        request.__dict__.pop('_cart_summary', None)
+        logger.info(f"Imported session cart with {len(session_cart)} items, Session key: {request.session.session_key}")
+    
+    @staticmethod
+    def get_items(request):
+        """Queryset of the current cart's items"""
+        from .models import CartItem
+        
+        owner = CartService.get_owner_filter(request)
+        if owner is None:
+            return CartItem.objects.none()
+        return CartItem.objects.filter(**owner).select_related(
+            'product', 'product__brand'
+        ).order_by('created_at', 'id')
+    
+    @staticmethod
+    def get_cart_items(request):
+        """Cart items prepared for templates"""
+        cart_items = []
+        for item in CartService.get_items(request):
+            cart_items.append({
+                'id': item.id,
+                'cart_key': item.id,
+                'product': item.product,
+                'size': item.size,
+                'color': item.color,
+                'quantity': item.quantity,
+                'total_price': item.get_total_price()
+            })
+        return cart_items
+    
+    @staticmethod
+    def get_item(request, item_id):
+        """Get one item of the current cart, or None"""
+        return CartService.get_items(request).filter(id=item_id).first()
     
     @staticmethod
     def add_to_cart(request, product_id, size, color, quantity=1):
-        """Add item to cart (session or database)"""
+        """Add item to cart"""
         try:
-            from .models import Product, CartItem
+            from .models import CartItem
             
-            product = Product.objects.get(id=product_id, is_active=True)
+            # Availability is checked against the variant stock by the caller
+            owner = CartService.get_owner_filter(request, create=True)
             
-            if request.user.is_authenticated:
-                # Add to database cart
-                cart_item, created = CartItem.objects.get_or_create(
-                    user=request.user,
-                    product=product,
-                    size=size,
-                    color=color,
-                    defaults={'quantity': quantity}
-                )
-                
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
-                logger.info(f"Added to authenticated user cart: {product.name} x{quantity}")
-            else:
-                # Ensure session exists for anonymous users
-                if not request.session.session_key:
-                    request.session.create()
-                
-                # Add to session cart
-                cart = request.session.get('cart', {})
-                cart_key = f"{product_id}_{size}_{color}"
-                
-                if cart_key in cart:
-                    cart[cart_key]['quantity'] += quantity
-                else:
-                    cart[cart_key] = {
-                        'product_id': int(product_id),
-                        'name': product.name,
-                        'brand': product.brand.name,
-                        'price': str(product.price),
-                        'size': size,
-                        'color': color,
-                        'quantity': quantity,
-                        'image': product.get_main_image().url if product.get_main_image() else None
-                    }
-                
-                request.session['cart'] = cart
-                request.session.modified = True
-                # Force save the session
-                request.session.save()
-                logger.info(f"Added to session cart: {product.name} x{quantity}, Session key: {request.session.session_key}")
+            cart_item, created = CartItem.objects.get_or_create(
+                product_id=product_id,
+                size=size,
+                color=color,
+                defaults={'quantity': quantity},
+                **owner
+            )
+            if not created:
+                cart_item.quantity += quantity
+                cart_item.save()
+            CartService.invalidate_summary(request, owner)
+            CartService.touch_session(request)
             
+            logger.info(f"Added to cart: product {product_id} size {size} x{quantity}, Owner: {request.user.username if request.user.is_authenticated else request.session.session_key}")
             return True
             
         except Exception as e:
@@ -1265,88 +2877,447 @@ class CartService:
             return False
     
     @staticmethod
-    def remove_from_cart(request, product_id, size):
-        """Remove item from cart"""
+    def touch_session(request):
+        """
+        Save the session on cart changes so its expiry moves forward; cart rows
+        are keyed on the session, which is otherwise only written when it changes
+        """
+        request.session.modified = True
+    
+    @staticmethod
+    def get_available_stock(product_id, size, color):
+        """Stock for one cart line, read from the variant table without loading the product"""
+        from .models import Product, ProductVariant
+        
+        stock = ProductVariant.objects.filter(
+            product_id=product_id, product__is_active=True
+        ).for_item(size, color).values_list('stock', flat=True).first()
+        if stock is None:
+            # Products without any variants keep a single stock count for the sizes they list
+            stock = Product.objects.filter(
+                id=product_id, is_active=True, variants__isnull=True
+            ).with_size(size).values_list('stock_quantity', flat=True).first()
+        return stock or 0
+    
+    @staticmethod
+    def update_quantity(request, item_id, quantity):
+        """Set an item's quantity; zero or less removes it"""
         try:
-            if request.user.is_authenticated:
-                from .models import CartItem
-                CartItem.objects.filter(
-                    user=request.user,
-                    product_id=product_id,
-                    size=size
-                ).delete()
+            items = CartService.get_items(request).filter(id=item_id)
+            if quantity > 0:
+                items.update(quantity=quantity, updated_at=timezone.now())
             else:
-                cart = request.session.get('cart', {})
-                cart_key = f"{product_id}_{size}"
-                if cart_key in cart:
-                    del cart[cart_key]
-                    request.session['cart'] = cart
-                    request.session.modified = True
-            
+                items.delete()
+            CartService.invalidate_summary(request)
+            CartService.touch_session(request)
+            return True
+        except Exception as e:
+            logger.error(f"Update cart quantity failed: {str(e)}")
+            return False
+    
+    @staticmethod
+    def remove_from_cart(request, item_id):
+        """Remove item from cart"""
+        try:
+            CartService.get_items(request).filter(id=item_id).delete()
+            CartService.invalidate_summary(request)
+            CartService.touch_session(request)
             return True
-            
         except Exception as e:
             logger.error(f"Remove from cart failed: {str(e)}")
             return False
     
     @staticmethod
-    def get_cart_total(request):
-        """Get cart total amount"""
-        total = 0
+    def clear_cart(request):
+        """Remove every item from the current cart"""
+        CartService.get_items(request).delete()
+        CartService.invalidate_summary(request)
+    
+    @staticmethod
+    def merge_guest_cart(request, user):
+        """Move the guest cart to a user; call before login() rotates the session key"""
+        from .models import CartItem
         
         try:
-            if request.user.is_authenticated:
+            owner = CartService.get_owner_filter(request)
+            if owner is None or owner.get('user') is not None:
+                return
+            for item in CartItem.objects.filter(**owner):
+                existing = CartItem.objects.filter(
+                    user=user, product_id=item.product_id, size=item.size, color=item.color
+                ).first()
+                if existing:
+                    existing.quantity += item.quantity
+                    existing.save()
+                    item.delete()
+                else:
+                    item.user = user
+                    item.session_key = None
+                    item.save()
+            CartService.invalidate_summary(request, owner)
+            CatalogCacheService.bump_version(CartService.get_summary_scope(user.pk))
+        except Exception as e:
+            logger.error(f"Merging guest cart failed: {str(e)}")
+    
+    @staticmethod
+    def get_summary_scope(user_id=None, session_key=None):
+        """Cache version scope of a cart"""
+        if user_id:
+            return f"cart:user:{user_id}"
+        return f"cart:session:{session_key}"
+    
+    @staticmethod
+    def get_owner_scope(owner):
+        """Cache version scope of a cart owner lookup"""
+        user = owner.get('user')
+        return CartService.get_summary_scope(user.pk if user else None, owner.get('session_key'))
+    
+    @staticmethod
+    def get_summary(request):
+        """
+        Count and total of the current cart: one aggregate query, memoized on
+        the request and cached until the cart or the catalog changes.
+        """
+        summary = getattr(request, '_cart_summary', None)
+        if summary is not None:
+            return summary
+        
+        summary = CartSummary()
+        try:
+            owner = CartService.get_owner_filter(request)
+            if owner is not None:
                 from .models import CartItem
-                cart_items = CartItem.objects.filter(user=request.user)
-                total = sum(item.get_total_price() for item in cart_items)
-                logger.debug(f"Authenticated user cart total: {total} from {cart_items.count()} items")
-            else:
-                cart = request.session.get('cart', {})
-                total = sum(float(item['price']) * item['quantity'] for item in cart.values())
-                logger.debug(f"Anonymous user cart total: {total} from session cart: {cart}")
+                
+                scope = CartService.get_owner_scope(owner)
+                # Product price changes bump the catalog version
+                versions = CatalogCacheService.get_versions([scope, 'catalog'])
+                key = f"{scope}:summary:{versions[0]}.{versions[1]}"
+                cached = cache.get(key)
+                if cached is None:
+                    totals = CartItem.objects.filter(**owner).aggregate(
+                        count=Sum('quantity'),
+                        total=Sum(F('quantity') * F('product__price')),
+                        lines=Count('id')
+                    )
+                    cached = (totals['count'] or 0, totals['total'] or Decimal('0'), totals['lines'])
+                    cache.set(key, cached, CartService.SUMMARY_TIMEOUT)
+                summary = CartSummary(*cached)
         except Exception as e:
-            logger.error(f"Error calculating cart total: {str(e)}")
-            
-        return total
+            logger.error(f"Error calculating cart summary: {str(e)}")
+        
+        request._cart_summary = summary
+        return summary
+    
+    @staticmethod
+    def invalidate_summary(request, owner=None):
+        """Drop the memoized and cached summary after the cart changed"""
+        request.__dict__.pop('_cart_summary', None)
+        owner = owner or CartService.get_owner_filter(request)
+        if owner is not None:
+            CatalogCacheService.bump_version(CartService.get_owner_scope(owner))
+    
+    @staticmethod
+    def get_cart_count(request):
+        """Get the number of pieces in the cart"""
+        return CartService.get_summary(request).count
+    
+    @staticmethod
+    def get_cart_total(request):
+        """Get cart total amount"""
+        return CartService.get_summary(request).total
+
+
+class WheelState:
+    """Wheel eligibility and unused prizes of one visitor"""
+    
+    def __init__(self, can_spin=True, discount=0, discount_name='', free_shipping=False, gift=None):
+        self.can_spin = can_spin
+        self.discount = discount  # Percentage
+        self.discount_name = discount_name
+        self.free_shipping = free_shipping
+        self.gift = gift  # {'name': ..., 'description': ...} or None
+    
+    def as_tuple(self):
+        return (self.can_spin, self.discount, self.discount_name, self.free_shipping, self.gift)
+    
+    @property
+    def has_prize(self):
+        return bool(self.discount or self.free_shipping or self.gift)
+
+
+class WheelPrizeTable:
+    """
+    Compiled wheel outcomes: the active segments in display order plus a Vose
+    alias table over the winnable ones, so a spin is O(1) whatever the number
+    of prizes. It also carries the pre-serialized segment snapshot the page
+    draws from. Instances are pickled into the cache, keep them plain data.
+    """
+    
+    def __init__(self, configs, control=None, version=0):
+        self.version = version
+        self.configs = list(configs)  # Active WheelConfiguration rows in display order
+        self.snapshot_json = None  # Set by serialize_snapshot()
+        self.control = control  # (mode, forced_prize_id, id, sequence_prizes) of the active WheelAdminControl
+        self.positions = {config.pk: index for index, config in enumerate(self.configs)}
+        
+        winnable = [index for index, config in enumerate(self.configs) if config.can_win]
+        weights = [self.configs[index].probability for index in winnable]
+        if not sum(weights):
+            # Nothing weighted: every winnable segment is equally likely
+            weights = [1] * len(winnable)
+        else:
+            winnable, weights = zip(*[(index, weight) for index, weight in zip(winnable, weights) if weight > 0])
+        self.outcomes = list(winnable)
+        self.weights = list(weights)
+        self.prob, self.alias = self.build_alias(self.weights)
+    
+    @staticmethod
+    def build_alias(weights):
+        """Vose's alias method: split each column between itself and one alias"""
+        count = len(weights)
+        if not count:
+            return [], []
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        prob = [1.0] * count
+        alias = list(range(count))
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # Whatever is left is 1 up to rounding
+        return prob, alias
+    
+    def sample(self, rng=random):
+        """Index of a randomly won segment, or None if nothing can be won"""
+        if not self.outcomes:
+            return None
+        column = rng.randrange(len(self.outcomes))
+        if rng.random() >= self.prob[column]:
+            column = self.alias[column]
+        return self.outcomes[column]
+    
+    def expected(self):
+        """Probability of each winnable segment index"""
+        total = sum(self.weights)
+        return {index: weight / total for index, weight in zip(self.outcomes, self.weights)}
+    
+    def build_snapshot(self):
+        """Segments with their angles, colors and text per language, as drawn on the wheel"""
+        segment_angle = 360 / len(self.configs) if self.configs else 0
+        return {
+            'version': self.version,
+            'segment_angle': segment_angle,
+            'segments': [
+                {
+                    'index': index,
+                    'id': config.pk,
+                    'name': config.name,
+                    'prize_type': config.prize_type,
+                    'value': config.value,
+                    'gift_description': config.gift_description if config.prize_type == 'gift' else '',
+                    'color': config.color,
+                    'can_win': config.can_win,
+                    'start_angle': index * segment_angle,
+                    'center_angle': (index + 0.5) * segment_angle,
+                    'text': config.get_display_texts(),
+                }
+                for index, config in enumerate(self.configs)
+            ],
+        }
+    
+    def serialize_snapshot(self):
+        """Store the snapshot as JSON that is also safe to inline in a <script> block"""
+        body = json.dumps(self.build_snapshot(), ensure_ascii=False, separators=(',', ':'))
+        self.snapshot_json = body.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+        return self.snapshot_json
+    
+    def find(self, config_id):
+        """Segment index of a configuration, or None if it is not on the wheel"""
+        try:
+            return self.positions.get(int(config_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def find_no_prize(self):
+        """Segment index of the first no-prize configuration"""
+        for index, config in enumerate(self.configs):
+            if config.prize_type == 'no_prize':
+                return index
+        return None
 
 
 class WheelService:
     """Wheel of Fortune service"""
     
+    STATE_KEY = 'wheel:state:{scope}:{day}'
+    PRIZE_TABLE_KEY = 'wheel:prize-table:{version}'
+    
+    _prize_table = None  # (version, WheelPrizeTable) of this process
+    
     @staticmethod
-    def can_spin_today(request):
-        """Check if user can spin today"""
+    def get_state_scope(user_id=None, session_key=None):
+        """Cache scope of a visitor's wheel state"""
+        if user_id:
+            return f"user:{user_id}"
+        return f"session:{session_key}"
+    
+    @staticmethod
+    def get_state_key(user_id=None, session_key=None):
+        """Cache key of a visitor's wheel state for the current local day"""
+        return WheelService.STATE_KEY.format(
+            scope=WheelService.get_state_scope(user_id, session_key),
+            day=timezone.localdate().isoformat()
+        )
+    
+    @staticmethod
+    def seconds_until_midnight():
+        """Seconds left in the current day in TIME_ZONE"""
+        from datetime import timedelta
+        
+        now = timezone.localtime()
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return max(int((midnight - now).total_seconds()), 1)
+    
+    @staticmethod
+    def get_state(request):
+        """
+        Wheel state of the current visitor: memoized on the request and
+        cached until midnight, or until a spin or checkout changes it.
+        """
+        state = getattr(request, '_wheel_state', None)
+        if state is not None:
+            return state
+        
+        state = WheelState()
+        try:
+            if request.user.is_authenticated:
+                owner = {'user_id': request.user.pk}
+            else:
+                # Don't create a session just to check spin status
+                owner = {'session_key': request.session.session_key} if request.session.session_key else None
+            
+            if owner is not None:
+                key = WheelService.get_state_key(**owner)
+                cached = cache.get(key)
+                if cached is None:
+                    cached = WheelService.compute_state(**owner).as_tuple()
+                    cache.set(key, cached, WheelService.seconds_until_midnight())
+                state = WheelState(*cached)
+        except Exception as e:
+            logger.error(f"Error loading wheel state: {str(e)}")
+        
+        request._wheel_state = state
+        return state
+    
+    @staticmethod
+    def compute_state(user_id=None, session_key=None):
+        """Build the wheel state from the visitor's WheelSpin rows"""
         from .models import WheelSpin
-        from django.utils import timezone
         
-        today = timezone.now().date()
+        spins = WheelSpin.objects.filter(user_id=user_id) if user_id else WheelSpin.objects.filter(session_key=session_key)
+        state = WheelState(can_spin=not spins.filter(spin_day=timezone.localdate()).exists())
         
-        # Additional check: if session flag is set, user has already spun
-        if request.session.get('wheel_spun_today', False):
-            return False
+        unused = spins.filter(is_used=False).order_by('-spin_date').values_list(
+            'prize_type', 'prize_name', 'discount_percentage', 'gift_description'
+        )
+        for prize_type, prize_name, discount_percentage, gift_description in unused:
+            if discount_percentage and not state.discount:
+                state.discount = discount_percentage
+                state.discount_name = prize_name or f"خصم {discount_percentage}%"
+            elif prize_type == 'free_shipping':
+                state.free_shipping = True
+            elif prize_type == 'gift' and state.gift is None:
+                state.gift = {'name': prize_name, 'description': gift_description}
+        return state
+    
+    @staticmethod
+    def invalidate_state(user_id=None, session_key=None, request=None):
+        """Drop the cached wheel state after a spin or checkout"""
+        if request is not None:
+            request.__dict__.pop('_wheel_state', None)
+        if user_id or session_key:
+            cache.delete(WheelService.get_state_key(user_id, session_key))
+    
+    @staticmethod
+    def merge_guest_spins(request, user):
+        """Move the guest's spins to a user; call before login() rotates the session key"""
+        from .models import WheelSpin
         
-        if request.user.is_authenticated:
-            return not WheelSpin.objects.filter(
-                user=request.user,
-                spin_date__date=today
-            ).exists()
-        else:
-            # For anonymous users, only check if session already exists
-            # Don't create session just to check spin status
+        try:
             session_key = request.session.session_key
             if not session_key:
-                # No session exists yet, user hasn't spun
-                return True
+                return
+            if WheelSpin.objects.filter(user=None, session_key=session_key).update(user=user, session_key=None):
+                WheelService.invalidate_state(session_key=session_key, request=request)
+                WheelService.invalidate_state(user_id=user.pk)
+        except Exception as e:
+            logger.error(f"Merging guest wheel spins failed: {str(e)}")
+    
+    @staticmethod
+    def can_spin_today(request):
+        """Check if user can spin today"""
+        return WheelService.get_state(request).can_spin
+    
+    @staticmethod
+    def get_prize_table():
+        """
+        Compiled prize table and segment snapshot of the current wheel
+        configuration: kept in the process and in the cache, rebuilt when the
+        'wheel' version changes.
+        """
+        version = CatalogCacheService.get_versions(['wheel'])[0]
+        memo = WheelService._prize_table
+        if memo is not None and memo[0] == version:
+            return memo[1]
+        
+        key = WheelService.PRIZE_TABLE_KEY.format(version=version)
+        table = cache.get(key)
+        if table is None:
+            from .models import WheelAdminControl, WheelConfiguration
             
-            return not WheelSpin.objects.filter(
-                session_key=session_key,
-                spin_date__date=today
-            ).exists()
+            control = WheelAdminControl.objects.filter(is_active=True).values_list(
+                'control_mode', 'forced_prize_id', 'id', 'sequence_prizes'
+            ).first()
+            table = WheelPrizeTable(WheelConfiguration.objects.filter(is_active=True).order_by('id'), control, version)
+            table.serialize_snapshot()
+            cache.set(key, table, None)
+        WheelService._prize_table = (version, table)
+        return table
+    
+    @staticmethod
+    def make_config_etag(version):
+        return f'"wheel-{version}"'
+    
+    @staticmethod
+    def choose_prize(table, rng=random):
+        """Segment index of the next outcome: admin control first, then the weighted draw"""
+        from .models import WheelAdminControl
+        
+        if table.control:
+            mode, forced_prize_id, control_id, sequence_prizes = table.control
+            index = None
+            if mode == 'force_prize' and forced_prize_id:
+                index = table.find(forced_prize_id)
+            elif mode == 'force_no_prize':
+                index = table.find_no_prize()
+            elif mode == 'sequence' and sequence_prizes:
+                # Sequence prizes are looked up in the table; only the cursor hits the database
+                position = WheelAdminControl.advance_sequence(control_id, len(sequence_prizes))
+                if position is not None:
+                    index = table.find(sequence_prizes[position])
+            if index is not None:
+                return index
+        return table.sample(rng)
     
     @staticmethod
     def spin_wheel(request):
         """Spin the wheel and get result"""
-        from .models import WheelSpin, WheelConfiguration, WheelAdminControl
+        from .models import WheelSpin
         
         # Double-check if user can spin today before proceeding
         if not WheelService.can_spin_today(request):
@@ -1357,37 +3328,9 @@ class WheelService:
             if not request.user.is_authenticated and not request.session.session_key:
                 request.session.create()
             
-            selected_config = None
-            
-            # Check for active admin control first
-            admin_control = WheelAdminControl.objects.filter(is_active=True).first()
-            if admin_control:
-                selected_config = admin_control.get_next_prize()
-            
-            # If no admin control or admin control returned None, use normal selection
-            if not selected_config:
-                # Use normal probability-based selection from winnable prizes only
-                configs = WheelConfiguration.objects.filter(is_active=True, can_win=True, probability__gt=0)
-                if not configs.exists():
-                    # No winnable prizes, return no prize
-                    discount_percentage = 0
-                    prize_type = 'no_prize'
-                else:
-                    # Weighted random selection based on probability
-                    total_probability = sum(config.probability for config in configs)
-                    if total_probability == 0:
-                        # All probabilities are 0, return no prize
-                        discount_percentage = 0
-                        prize_type = 'no_prize'
-                    else:
-                        random_num = random.randint(1, total_probability)
-                        
-                        current_prob = 0
-                        for config in configs:
-                            current_prob += config.probability
-                            if random_num <= current_prob:
-                                selected_config = config
-                                break
+            table = WheelService.get_prize_table()
+            index = WheelService.choose_prize(table)
+            selected_config = table.configs[index] if index is not None else None
             
             # Set result based on selected config
             if selected_config:
@@ -1404,11 +3347,6 @@ class WheelService:
                 discount_percentage=discount_percentage
             )
             
-            # Set session variable for discount if won
-            if discount_percentage > 0:
-                request.session['wheel_discount'] = discount_percentage
-                request.session['wheel_discount_date'] = timezone.now().date().isoformat()
-            
             return {
                 'success': True,
                 'discount_percentage': discount_percentage,
@@ -1425,24 +3363,7 @@ class WheelService:
     @staticmethod
     def get_available_discount(request):
         """Get available wheel discount for user"""
-        from .models import WheelSpin
-        
-        if request.user.is_authenticated:
-            wheel_spin = WheelSpin.objects.filter(
-                user=request.user,
-                is_used=False
-            ).first()
-        else:
-            session_key = request.session.session_key
-            if not session_key:
-                return 0
-            
-            wheel_spin = WheelSpin.objects.filter(
-                session_key=session_key,
-                is_used=False
-            ).first()
-        
-        return wheel_spin.discount_percentage if wheel_spin else 0
+        return WheelService.get_state(request).discount
 
 
 class EmailService:
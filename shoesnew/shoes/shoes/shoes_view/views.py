@@ -8,26 +8,32 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
+from django.core.files.storage import default_storage
 from django.core.paginator import Paginator
-from django.db.models import Q, Count, Avg, Min, Max
+from django.db.models import Q, Count, Avg, Min, Max, Prefetch
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.translation import activate, get_language
 from django.utils import translation, timezone
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from decimal import Decimal
-import json
 import logging
+import random
+from urllib.parse import urlencode
 from django.template.loader import render_to_string
 
 from .models import (
-    Brand, Product, ProductImage, Customer, Order, OrderItem, CartItem, 
-    WheelSpin, WheelConfiguration, UserProfile, ContactMessage
+    Brand, Product, ProductImage, Customer, Order, OrderItem, 
+    WheelSpin, UserProfile, ContactMessage
 )
 from .utils import (
     TelegramService, PrintService, TranslationService, 
-    CartService, WheelService, FileService
+    CartService, WheelService, CatalogCacheService, OrderEventService,
+    CatalogSnapshotService, CatalogStatsService, FacetService, ImageService, OrderService, OutOfStockError,
+    SearchIndexService, ViewCounterService
 )
 from .forms import CheckoutForm, ContactForm, UserRegistrationForm, CustomLoginForm
 
@@ -42,23 +48,21 @@ def home(request):
             is_featured=True, 
             is_active=True,
             stock_quantity__gt=0
-        ).select_related('brand')[:8]
+        ).for_listing()[:8]
         
-        # Get popular brands
-        popular_brands = Brand.objects.filter(
-            is_active=True
-        ).annotate(
-            product_count=Count('products')
-        ).filter(product_count__gt=0)[:6]
+        # Get popular brands (counts precomputed per catalog version)
+        popular_brands = [
+            brand for brand in CatalogStatsService.get_stats()['brands'] if brand.product_count > 0
+        ][:6]
         
         # Get latest products
         latest_products = Product.objects.filter(
             is_active=True,
             stock_quantity__gt=0
-        ).select_related('brand').order_by('-created_at')[:12]
+        ).for_listing().order_by('-created_at')[:12]
         
         # Check if user can spin wheel today
-        can_spin_today = WheelService.can_spin_today(request)
+        can_spin_today = WheelService.get_state(request).can_spin
         
         # Show welcome popup for new visitors
         show_welcome_popup = not request.session.get('visited_before', False)
@@ -81,72 +85,125 @@ def home(request):
         return render(request, 'shoes_view/home.html', {})
 
 
+# Sort option -> (ordering field, descending). The id breaks ties so the
+# order is total, which the cursor API relies on.
+PRODUCT_SORTS = {
+    'newest': ('created_at', True),
+    '-created_at': ('created_at', True),
+    'created_at': ('created_at', False),
+    'price_asc': ('price', False),
+    'price': ('price', False),
+    'price_desc': ('price', True),
+    '-price': ('price', True),
+    'name_asc': ('name', False),
+    'name': ('name', False),
+    '-name': ('name', True),
+    'relevance': ('relevance', True),
+}
+
+
+def get_sort_key(sort, searched=False):
+    """Resolve a sort option from the query string to (field, descending)"""
+    if sort == 'relevance' and not searched:
+        sort = 'newest'
+    return PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest'])
+
+
+def sort_products(products_list, sort, searched=False):
+    """Order a product listing by a sort option from the query string"""
+    field, descending = get_sort_key(sort, searched)
+    prefix = '-' if descending else ''
+    return products_list.order_by(f"{prefix}{field}", f"{prefix}id")
+
+
+def get_product_filters(request):
+    """Read the listing filters from the query string"""
+    search = request.GET.get('search', '').strip()
+    return {
+        'search': search,
+        'brand': request.GET.getlist('brand'),
+        'color': request.GET.get('color'),
+        'size': request.GET.get('size'),
+        'min_price': request.GET.get('min_price'),
+        'max_price': request.GET.get('max_price'),
+        'sort': request.GET.get('sort') or ('relevance' if search else '-created_at')
+    }
+
+
+def filter_products(products_list, filters):
+    """Apply the listing filters (not the sort) to a product queryset"""
+    if filters['search']:
+        products_list = products_list.search(filters['search'])
+    
+    if filters['brand']:
+        products_list = products_list.filter(brand_id__in=filters['brand'])
+    
+    if filters['color']:
+        products_list = products_list.filter(color=filters['color'])
+    
+    if filters['size']:
+        products_list = products_list.with_size(filters['size'])
+    
+    if filters['min_price']:
+        try:
+            products_list = products_list.filter(price__gte=Decimal(filters['min_price']))
+        except (ArithmeticError, ValueError, TypeError):
+            pass
+            
+    if filters['max_price']:
+        try:
+            products_list = products_list.filter(price__lte=Decimal(filters['max_price']))
+        except (ArithmeticError, ValueError, TypeError):
+            pass
+    
+    return products_list
+
+
+def make_product_cursor(product, field):
+    """Cursor pointing just past a product: '<sort value>,<id>'"""
+    value = getattr(product, field)
+    if field == 'created_at':
+        value = value.isoformat()
+    return f"{value},{product.pk}"
+
+
+def parse_product_cursor(cursor, field):
+    """Split a cursor into (sort value, id); raises ValueError when malformed"""
+    value, product_id = cursor.rsplit(',', 1)
+    if field == 'created_at':
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError('Invalid cursor date')
+    elif field == 'price':
+        try:
+            value = Decimal(value)
+        except ArithmeticError:
+            raise ValueError('Invalid cursor price')
+    elif field == 'relevance':
+        value = float(value)
+    return value, int(product_id)
+
+
+@CatalogCacheService.cache_page('products', lambda request: ['catalog'])
 def products(request):
     """Products listing page with search and filters"""
     try:
         # Start with optimized base query
         products_list = Product.objects.filter(
             is_active=True
-        ).select_related('brand').only(
-            'id', 'name', 'name_en', 'price', 'description',
-            'color', 'sizes', 'stock_quantity', 'brand__name', 'brand__id'
-        )
+        ).for_listing()
         
         # Get selected brands from the request
         selected_brands = request.GET.getlist('brand')
 
         # Build filters dict to reduce repeated GET calls
-        filters = {
-            'search': request.GET.get('search', '').strip(),
-            'brand': selected_brands, # Use the list of brands
-            'color': request.GET.get('color'),
-            'size': request.GET.get('size'),
-            'min_price': request.GET.get('min_price'),
-            'max_price': request.GET.get('max_price'),
-            'sort': request.GET.get('sort', '-created_at')
-        }
+        filters = get_product_filters(request)
         
         # Apply filters
-        if filters['search']:
-            products_list = products_list.filter(
-                Q(name__icontains=filters['search']) |
-                Q(name_en__icontains=filters['search']) |
-                Q(brand__name__icontains=filters['search'])
-            )
-        
-        if filters['brand']:
-            products_list = products_list.filter(brand_id__in=filters['brand'])
-        
-        if filters['color']:
-            products_list = products_list.filter(color=filters['color'])
-        
-        if filters['size']:
-            # SQLite-compatible size filtering
-            from django.db import connection
-            if 'sqlite' in connection.vendor:
-                # Use icontains for SQLite compatibility
-                products_list = products_list.filter(sizes__icontains=f'"{filters["size"]}"')
-            else:
-                products_list = products_list.filter(sizes__contains=[filters['size']])
-        
-        if filters['min_price']:
-            try:
-                products_list = products_list.filter(price__gte=Decimal(filters['min_price']))
-            except (ValueError, TypeError):
-                pass
-                
-        if filters['max_price']:
-            try:
-                products_list = products_list.filter(price__lte=Decimal(filters['max_price']))
-            except (ValueError, TypeError):
-                pass
+        products_list = filter_products(products_list, filters)
         
         # Apply sorting
-        valid_sorts = ['price', '-price', 'name', '-name', '-created_at', 'created_at']
-        if filters['sort'] in valid_sorts:
-            products_list = products_list.order_by(filters['sort'])
-        else:
-            products_list = products_list.order_by('-created_at')
+        products_list = sort_products(products_list, filters['sort'], searched=bool(filters['search']))
         
         # Pagination with optimized count
         paginator = Paginator(products_list, 9)  # 9 products per page for better grid layout
@@ -157,26 +214,36 @@ def products(request):
             page_number = 1
         products = paginator.get_page(page_number)
         
-        # Get filter options efficiently
-        brands = Brand.objects.filter(is_active=True).only('id', 'name')
+        # Infinite scroll continues from the last card through the cursor API
+        next_cursor = None
+        if products.has_next():
+            sort_field, descending = get_sort_key(filters['sort'], bool(filters['search']))
+            next_cursor = make_product_cursor(products[len(products) - 1], sort_field)
         
-        # Only get price range if needed (no filters applied)
+        # Get filter options efficiently, with a count next to each value
+        catalog_stats = CatalogStatsService.get_stats()
+        facets = FacetService.get_facets(filters)
+        brands = catalog_stats['brands']
+        for brand in brands:
+            brand.facet_count = facets['brands'].get(brand.id, 0)
+        
+        # Only show the price range when no filters are applied
         price_range = None
         if not any([filters['brand'], filters['color'], filters['size'], filters['search']]):
-            price_range = Product.objects.filter(is_active=True).aggregate(
-                min_price=Min('price'),
-                max_price=Max('price')
-            )
+            price_range = catalog_stats['price_range']
         
         context = {
             'products': products,
             'brands': brands,
-            'colors': Product.COLORS,
-            'sizes': Product.SIZES,
+            'colors': [(code, name, facets['colors'].get(code, 0)) for code, name in Product.COLORS],
+            'sizes': [(value, label, facets['sizes'].get(value, 0)) for value, label in Product.SIZES],
+            'price_buckets': facets['prices'],
             'price_range': price_range,
             'current_filters': filters,
             'total_products': paginator.count,
             'selected_brands': selected_brands, # Pass the list to the template
+            'next_cursor': next_cursor,
+            'api_query': urlencode([(key, value) for key, values in request.GET.lists() for value in values if key != 'page'], doseq=False),
         }
         
         return render(request, 'shoes_view/products.html', context)
@@ -187,38 +254,59 @@ def products(request):
         return render(request, 'shoes_view/products.html', {'products': [], 'brands': []})
 
 
+def count_product_view(request, product_id):
+    """Buffer a product view; the counts reach the database in batches"""
+    ViewCounterService.record(request, product_id)
+
+
+@CatalogCacheService.cache_page(
+    'product_detail',
+    lambda request, product_id: CatalogCacheService.get_product_scopes(product_id),
+    on_hit=count_product_view
+)
 def product_detail(request, product_id):
     """Product detail page"""
     try:
         product = get_object_or_404(
-            Product.objects.select_related('brand').prefetch_related('images'),
+            Product.objects.select_related('brand').prefetch_related(
+                Prefetch('images', queryset=ProductImage.objects.select_related('color_variant'))
+            ),
             id=product_id,
             is_active=True
         )
         
         # Increment view count
+        count_product_view(request, product.id)
         product.views_count += 1
-        product.save(update_fields=['views_count'])
         
-        # Get related products (same brand)
+        # Precomputed related products (one indexed lookup)
         related_products = Product.objects.filter(
+            related_in__product_id=product.id,
+            is_active=True
+        ).order_by('-related_in__score').for_listing()[:4]
+        
+        # Same brand until the product's list is first computed
+        fallback_related_products = Product.objects.filter(
             brand=product.brand,
             is_active=True
-        ).exclude(id=product.id)[:4]
+        ).exclude(id=product.id).for_listing()[:4]
         
-        # Get product images
-        product_images = product.images.all().order_by('order')
+        # Get product images from the prefetched gallery (no extra query)
+        product_images = sorted(product.images.all(), key=lambda image: (image.order, image.id))
+        if getattr(settings, 'PRODUCT_GALLERY_SHUFFLE', False):
+            # Optional shuffle mode - done in Python so the database never sorts randomly
+            random.shuffle(product_images)
         
-        # Get color variants
+        # Get color variants (same model in other colors, by the indexed variant group)
         color_variants = Product.objects.filter(
-            name=product.name,
-            brand=product.brand,
+            variant_group=product.variant_group,
             is_active=True
-        ).exclude(id=product.id)
+        ).exclude(id=product.id).for_listing()[:6]
         
         context = {
             'product': product,
             'related_products': related_products,
+            'fallback_related_products': fallback_related_products,
             'product_images': product_images,
             'color_variants': color_variants,
         }
@@ -246,36 +334,21 @@ def add_to_cart(request):
                 'message': 'معلومات المنتج غير مكتملة'
             })
         
-        # Check product availability
-        product = get_object_or_404(Product, id=product_id, is_active=True)
-        if product.stock_quantity < quantity:
+        # Check stock of the chosen size and color
+        if CartService.get_available_stock(product_id, size, color) < quantity:
             return JsonResponse({
                 'success': False,
                 'message': 'الكمية المطلوبة غير متاحة'
             })
         
-        # Ensure session exists for anonymous users
-        if not request.user.is_authenticated and not request.session.session_key:
-            request.session.create()
-        
         # Add to cart
         success = CartService.add_to_cart(request, product_id, size, color, quantity)
         
         if success:
-            # Force session save for anonymous users
-            if not request.user.is_authenticated:
-                request.session.save()
-            
             # Get updated cart count and total
-            cart_count = 0
-            if request.user.is_authenticated:
-                cart_items = CartItem.objects.filter(user=request.user)
-                cart_count = sum(item.quantity for item in cart_items)
-            else:
-                cart = request.session.get('cart', {})
-                cart_count = sum(item['quantity'] for item in cart.values())
-            
-            cart_total = CartService.get_cart_total(request)
+            cart_summary = CartService.get_summary(request)
+            cart_count = cart_summary.count
+            cart_total = cart_summary.total
             
             return JsonResponse({
                 'success': True,
@@ -300,50 +373,18 @@ def add_to_cart(request):
 def cart(request):
     """Shopping cart page"""
     try:
-        cart_items = []
-        total_amount = 0
+        cart_items = CartService.get_cart_items(request)
+        total_amount = CartService.get_summary(request).total
         
-        if request.user.is_authenticated:
-            # Get cart items from database
-            db_cart_items = CartItem.objects.filter(
-                user=request.user
-            ).select_related('product', 'product__brand')
-            
-            for item in db_cart_items:
-                cart_items.append({
-                    'id': item.id,
-                    'product': item.product,
-                    'size': item.size,
-                    'quantity': item.quantity,
-                    'total_price': item.get_total_price()
-                })
-                total_amount += item.get_total_price()
-        else:
-            # Get cart items from session
-            session_cart = request.session.get('cart', {})
-            for cart_key, item_data in session_cart.items():
-                try:
-                    product = Product.objects.get(id=item_data['product_id'])
-                    item_total = Decimal(item_data['price']) * item_data['quantity']
-                    cart_items.append({
-                        'cart_key': cart_key,
-                        'product': product,
-                        'size': item_data['size'],
-                        'quantity': item_data['quantity'],
-                        'total_price': item_total
-                    })
-                    total_amount += item_total
-                except Product.DoesNotExist:
-                    continue
-        
-        # Check for available wheel discount
-        available_discount = WheelService.get_available_discount(request)
+        # Check for available wheel prizes
+        wheel_state = WheelService.get_state(request)
+        available_discount = wheel_state.discount
         discount_amount = (total_amount * available_discount / 100) if available_discount else 0
         final_amount = total_amount - discount_amount
         
         # Check for other wheel prizes
-        available_free_shipping = request.session.get('wheel_free_shipping', False)
-        available_gift = request.session.get('wheel_gift', {})
+        available_free_shipping = wheel_state.free_shipping
+        available_gift = wheel_state.gift or {}
         
         # Get wheel prize information for display
         wheel_prizes = {
@@ -404,25 +445,11 @@ def remove_from_cart(request):
         if not cart_key:
             return JsonResponse({'success': False, 'message': 'لم يتم تقديم معرّف المنتج'})
 
-        if request.user.is_authenticated:
-            # For authenticated users, cart_key is the CartItem ID
-            CartItem.objects.filter(id=cart_key, user=request.user).delete()
-        else:
-            # For guest users, cart_key is the session key for the item
-            cart = request.session.get('cart', {})
-            if cart_key in cart:
-                del cart[cart_key]
-                request.session['cart'] = cart
-                request.session.modified = True
+        # cart_key is the CartItem ID for both users and guests
+        CartService.remove_from_cart(request, cart_key)
         
         # Calculate new cart count
-        cart_count = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user)
-            cart_count = sum(item.quantity for item in cart_items)
-        else:
-            cart = request.session.get('cart', {})
-            cart_count = sum(item['quantity'] for item in cart.values())
+        cart_count = CartService.get_cart_count(request)
 
         return JsonResponse({
             'success': True, 
@@ -443,59 +470,22 @@ def checkout(request):
         logger.info(f"Checkout - Cart total: {cart_total}, User: {request.user.username if request.user.is_authenticated else 'Anonymous'}")
         
         if cart_total == 0:
-            # Debug: Check what's in the cart
-            if request.user.is_authenticated:
-                cart_items_count = CartItem.objects.filter(user=request.user).count()
-                logger.warning(f"Empty cart for authenticated user - DB cart items: {cart_items_count}")
-            else:
-                session_cart = request.session.get('cart', {})
-                logger.warning(f"Empty cart for anonymous user - Session cart: {session_cart}")
-                logger.warning(f"Session key: {request.session.session_key}")
-            
+            logger.warning(f"Empty cart at checkout - Session key: {request.session.session_key}")
             messages.warning(request, 'السلة فارغة')
             return redirect('shoes_view:cart')
 
         # Get cart items for display
-        cart_items = []
-        if request.user.is_authenticated:
-            # Get cart items from database
-            db_cart_items = CartItem.objects.filter(
-                user=request.user
-            ).select_related('product', 'product__brand')
-            
-            for item in db_cart_items:
-                cart_items.append({
-                    'id': item.id,
-                    'product': item.product,
-                    'size': item.size,
-                    'quantity': item.quantity,
-                    'total_price': item.get_total_price()
-                })
-        else:
-            # Get cart items from session
-            session_cart = request.session.get('cart', {})
-            for cart_key, item_data in session_cart.items():
-                try:
-                    product = Product.objects.get(id=item_data['product_id'])
-                    item_total = Decimal(item_data['price']) * item_data['quantity']
-                    cart_items.append({
-                        'cart_key': cart_key,
-                        'product': product,
-                        'size': item_data['size'],
-                        'quantity': item_data['quantity'],
-                        'total_price': item_total
-                    })
-                except Product.DoesNotExist:
-                    continue
+        cart_items = CartService.get_cart_items(request)
         
         # Apply wheel discount
-        available_discount = WheelService.get_available_discount(request)
+        wheel_state = WheelService.get_state(request)
+        available_discount = wheel_state.discount
         discount_amount = (cart_total * available_discount / 100) if available_discount else 0
         final_amount = cart_total - discount_amount
         
-        # Check for free shipping and gifts from session
-        available_free_shipping = request.session.get('wheel_free_shipping', False)
-        available_gift = request.session.get('wheel_gift', {})
+        # Check for free shipping and gifts
+        available_free_shipping = wheel_state.free_shipping
+        available_gift = wheel_state.gift or {}
         
         # Get wheel prize information for display
         wheel_prizes = {
@@ -529,120 +519,20 @@ def checkout(request):
             form = CheckoutForm(request.POST)
             if form.is_valid():
                 try:
-                    # Create or get customer
-                    customer_data = {
-                        'full_name': form.cleaned_data['full_name'],
-                        'phone': form.cleaned_data['phone'],
-                        'city': form.cleaned_data['city'],
-                        'street_address': form.cleaned_data['address'],
-                    }
-                    
-                    if request.user.is_authenticated:
-                        customer, created = Customer.objects.get_or_create(
-                            user=request.user,
-                            defaults=customer_data
-                        )
-                        if not created:
-                            # Update customer info
-                            for field, value in customer_data.items():
-                                setattr(customer, field, value)
-                            customer.save()
-                    else:
-                        # Ensure session is created for guest users
-                        if not request.session.session_key:
-                            request.session.create()
-                        customer_data['session_key'] = request.session.session_key
-                        customer = Customer.objects.create(**customer_data)
-                    
-                    # Create order
-                    order = Order.objects.create(
-                        customer=customer,
-                        payment_method=form.cleaned_data['payment_method'],
-                        total_amount=cart_total,
-                        discount_amount=discount_amount,
-                        final_amount=final_amount,
-                        wheel_free_shipping=available_free_shipping,
-                        wheel_gift_name=available_gift.get('name', '') if available_gift else '',
-                        wheel_gift_description=available_gift.get('description', '') if available_gift else '',
-                        notes=form.cleaned_data.get('notes', '')
+                    order = OrderService.place_order(
+                        request,
+                        form.cleaned_data,
+                        discount_percentage=available_discount,
+                        free_shipping=available_free_shipping,
+                        gift=available_gift
                     )
                     
-                    # Create order items
-                    if request.user.is_authenticated:
-                        db_cart_items = CartItem.objects.filter(user=request.user)
-                        for item in db_cart_items:
-                            OrderItem.objects.create(
-                                order=order,
-                                product=item.product,
-                                size=item.size,
-                                quantity=item.quantity,
-                                price=item.product.price
-                            )
-                        # Clear cart
-                        db_cart_items.delete()
-                    else:
-                        session_cart = request.session.get('cart', {})
-                        for item_data in session_cart.values():
-                            product = Product.objects.get(id=item_data['product_id'])
-                            OrderItem.objects.create(
-                                order=order,
-                                product=product,
-                                size=item_data['size'],
-                                quantity=item_data['quantity'],
-                                price=product.price
-                            )
-                        # Clear session cart
-                        request.session['cart'] = {}
-                        request.session.modified = True
-                    
-                    # Mark wheel prizes as used
-                    if available_discount > 0 or available_free_shipping or available_gift:
-                        if request.user.is_authenticated:
-                            # Mark all unused wheel spins as used for authenticated users
-                            WheelSpin.objects.filter(
-                                user=request.user, 
-                                is_used=False
-                            ).update(is_used=True, used_date=timezone.now())
-                        else:
-                            # Mark all unused wheel spins as used for session users
-                            WheelSpin.objects.filter(
-                                session_key=request.session.session_key, 
-                                is_used=False
-                            ).update(is_used=True, used_date=timezone.now())
-                    
-                    # Clear wheel prizes from session
-                    session_keys_to_clear = [
-                        'wheel_discount', 'wheel_discount_date',
-                        'wheel_free_shipping', 'wheel_free_shipping_date',
-                        'wheel_gift', 'wheel_gift_date'
-                    ]
-                    for key in session_keys_to_clear:
-                        if key in request.session:
-                            del request.session[key]
-                    request.session.modified = True
-                    
-                    # Save order to file first (most important)
-                    try:
-                        FileService.save_order_to_file(order)
-                    except Exception as e:
-                        logger.error(f"File service failed for order {order.order_id}: {str(e)}")
-                    
-                    # Send notifications (non-blocking)
-                    try:
-                        TelegramService.send_order_notification(order)
-                    except Exception as e:
-                        logger.warning(f"Telegram notification failed for order {order.order_id}: {str(e)}")
-                    
-                    try:
-                        PrintService.print_order(order)
-                    except Exception as e:
-                        logger.warning(f"Print service failed for order {order.order_id}: {str(e)}")
-                    
-                    # Email service removed - no longer needed
-                    
                     messages.success(request, f'تم إنشاء طلبك بنجاح. رقم الطلب: {order.order_id}')
                     return redirect('shoes_view:order_confirmation', order_id=order.order_id)
                     
+                except OutOfStockError as e:
+                    messages.error(request, str(e))
+                    return redirect('shoes_view:cart')
                 except Exception as e:
                     logger.error(f"Checkout error: {str(e)}")
                     messages.error(request, 'حدث خطأ في معالجة الطلب')
@@ -681,7 +571,10 @@ def checkout(request):
 def order_confirmation(request, order_id):
     """Order confirmation page"""
     try:
-        order = get_object_or_404(Order, order_id=order_id)
+        order = get_object_or_404(
+            Order.objects.select_related('customer').prefetch_related('items__product'),
+            order_id=order_id
+        )
         
         # Check if user has access to this order
         if request.user.is_authenticated:
@@ -712,7 +605,10 @@ def order_confirmation(request, order_id):
 def order_detail(request, order_id):
     """Order detail page"""
     try:
-        order = get_object_or_404(Order, order_id=order_id)
+        order = get_object_or_404(
+            Order.objects.select_related('customer').prefetch_related('items__product'),
+            order_id=order_id
+        )
         
         # Check if user has access to this order
         if request.user.is_authenticated:
@@ -849,70 +745,39 @@ def admin_test_printer(request):
 def wheel_of_fortune(request):
     """Wheel of Fortune page"""
     try:
-        can_spin_today = WheelService.can_spin_today(request)
-        available_discount_percentage = WheelService.get_available_discount(request)
+        wheel_state = WheelService.get_state(request)
+        can_spin_today = wheel_state.can_spin
         
-        # Get available prizes from session (discount, free shipping, gift)
+        # Unused prizes (discount, free shipping, gift)
         available_discount = None
-        available_free_shipping = False
         available_gift = None
+        available_free_shipping = wheel_state.free_shipping
+        
+        if wheel_state.discount > 0:
+            available_discount = {
+                'name': wheel_state.discount_name,
+                'prize_type': 'discount',
+                'value': wheel_state.discount,
+                'discount_percentage': wheel_state.discount,
+            }
         
-        # Check for discount
-        if available_discount_percentage > 0:
-            # Find the wheel configuration that matches this discount
-            wheel_config = WheelConfiguration.objects.filter(
-                is_active=True,
-                prize_type='discount',
-                value=available_discount_percentage
-            ).first()
-            
-            if wheel_config:
-                available_discount = {
-                    'name': wheel_config.name,
-                    'prize_type': wheel_config.prize_type,
-                    'value': wheel_config.value,
-                    'discount_percentage': wheel_config.value,
-                }
-        
-        # Check for free shipping
-        if request.session.get('wheel_free_shipping', False):
-            available_free_shipping = True
-        
-        # Check for gift
-        wheel_gift = request.session.get('wheel_gift', {})
-        if wheel_gift:
+        if wheel_state.gift:
             available_gift = {
-                'name': wheel_gift.get('name', ''),
-                'description': wheel_gift.get('description', ''),
+                'name': wheel_state.gift.get('name', ''),
+                'description': wheel_state.gift.get('description', ''),
                 'prize_type': 'gift'
             }
         
-        # Get wheel configurations for display - show ALL active prizes in consistent order
-        wheel_configs = WheelConfiguration.objects.filter(is_active=True).order_by('id')
-        
-        # Serialize wheel configs for JavaScript
-        wheel_configs_json = []
-        for config in wheel_configs:
-            wheel_configs_json.append({
-                'id': config.id,
-                'name': config.name,
-                'prize_type': config.prize_type,
-                'value': config.value,
-                'gift_description': config.gift_description,
-                'probability': config.probability,
-                'color': config.color,
-                'is_active': config.is_active,
-                'can_win': config.can_win,
-                'display_text': config.get_display_text()
-            })
+        # Pre-serialized segment snapshot of the active prizes in display order
+        wheel_table = WheelService.get_prize_table()
         
         context = {
             'can_spin_today': can_spin_today,
             'available_discount': available_discount,
             'available_free_shipping': available_free_shipping,
             'available_gift': available_gift,
-            'wheel_configs': wheel_configs,
-            'wheel_configs_json': json.dumps(wheel_configs_json),
+            'wheel_config_version': wheel_table.version,
+            'wheel_config_json': wheel_table.snapshot_json,
         }
         
         return render(request, 'shoes_view/wheel.html', context)
@@ -932,14 +797,15 @@ def wheel_api_v2(request):
         import random
         
         # Check if user can spin
-        if not WheelService.can_spin_today(request):
+        if not WheelService.get_state(request).can_spin:
             return JsonResponse({
                 'success': False,
                 'message': 'لقد دورت العجلة اليوم بالفعل. جرب غداً مرة أخرى!'
             })
         
-        # Get all active wheel configurations in display order
-        wheel_configs = list(WheelConfiguration.objects.filter(is_active=True).order_by('id'))
+        # Compiled table of the active segments in display order
+        table = WheelService.get_prize_table()
+        wheel_configs = table.configs
         
         if not wheel_configs:
             return JsonResponse({
@@ -947,25 +813,14 @@ def wheel_api_v2(request):
                 'message': 'لا توجد جوائز متاحة'
             })
         
-        # Get winnable segments with their indices
-        winnable_segments = []
-        for index, config in enumerate(wheel_configs):
-            if config.can_win:
-                winnable_segments.append({
-                    'index': index,
-                    'config': config
-                })
-        
-        if not winnable_segments:
+        # Admin control or weighted draw over the winnable segments
+        target_index = WheelService.choose_prize(table)
+        if target_index is None:
             return JsonResponse({
                 'success': False,
                 'message': 'لا توجد جوائز قابلة للفوز'
             })
-        
-        # Select random winnable segment
-        selected = random.choice(winnable_segments)
-        target_index = selected['index']
-        selected_config = selected['config']
+        selected_config = wheel_configs[target_index]
         
         # Calculate wheel parameters
         total_segments = len(wheel_configs)
@@ -1006,27 +861,9 @@ def wheel_api_v2(request):
         if selected_config.prize_type == 'gift':
             wheel_spin_data['gift_description'] = selected_config.gift_description
         
+        # The post_save signal invalidates the cached wheel state
         WheelSpin.objects.create(**wheel_spin_data)
-        
-        # Set session variables based on prize type
-        if selected_config.prize_type == 'discount' and selected_config.value > 0:
-            request.session['wheel_discount'] = selected_config.value
-            request.session['wheel_discount_date'] = timezone.now().date().isoformat()
-        elif selected_config.prize_type == 'free_shipping':
-            request.session['wheel_free_shipping'] = True
-            request.session['wheel_free_shipping_date'] = timezone.now().date().isoformat()
-        elif selected_config.prize_type == 'gift':
-            request.session['wheel_gift'] = {
-                'name': selected_config.name,
-                'description': selected_config.gift_description
-            }
-            request.session['wheel_gift_date'] = timezone.now().date().isoformat()
-        
-        request.session['wheel_spun_today'] = True
-        request.session.modified = True
-        
-        # Prepare segment text using the new get_display_text method
-        segment_text = selected_config.get_display_text()
+        request.__dict__.pop('_wheel_state', None)
         
         # Prepare success message based on prize type
         if selected_config.prize_type == 'discount':
@@ -1038,15 +875,12 @@ def wheel_api_v2(request):
         else:
             success_message = 'حاول مرة أخرى!'
         
+        # Segment text, prize and colors come from the client's config snapshot
         return JsonResponse({
             'success': True,
+            'config_version': table.version,
             'target_index': target_index,
             'target_rotation_radians': final_rotation_radians,
-            'segment_text': segment_text,
-            'prize_type': selected_config.prize_type,
-            'prize_name': selected_config.name,
-            'discount_percentage': selected_config.value if selected_config.prize_type == 'discount' else 0,
-            'gift_description': selected_config.gift_description if selected_config.prize_type == 'gift' else '',
             'message': success_message
         })
         
@@ -1058,6 +892,29 @@ def wheel_api_v2(request):
         })
 
 
+def wheel_config(request):
+    """
+    Segment snapshot of the wheel (angles, colors, text per language), the
+    same payload the wheel page inlines. Revalidated with its ETag.
+    """
+    try:
+        table = WheelService.get_prize_table()
+        etag = WheelService.make_config_etag(table.version)
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(table.snapshot_json, content_type='application/json; charset=utf-8')
+        
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, no-cache'  # Shared caches may store it, always revalidated
+        response['X-Wheel-Config-Version'] = str(table.version)
+        return response
+        
+    except Exception as e:
+        logger.error(f"Wheel config error: {str(e)}")
+        return JsonResponse({'error': 'حدث خطأ في تحميل إعدادات العجلة'}, status=500)
+
+
 def contact(request):
     """Contact page"""
     try:
@@ -1082,15 +939,24 @@ def contact(request):
         return render(request, 'shoes_view/contact.html', {'form': ContactForm()})
 
 
+@CatalogCacheService.cache_page('brand_products', lambda request, brand_id: [f"brand:{brand_id}"])
 def brand_products(request, brand_id):
     """Products by brand"""
     try:
         brand = get_object_or_404(Brand, id=brand_id, is_active=True)
         
+        filters = {
+            'size': request.GET.get('size', ''),
+            'sort': request.GET.get('sort', 'newest'),
+        }
+        
         products_list = Product.objects.filter(
             brand=brand,
             is_active=True
-        ).order_by('-created_at')
+        ).for_listing()
+        if filters['size']:
+            products_list = products_list.with_size(filters['size'])
+        products_list = sort_products(products_list, filters['sort'])
         
         # Pagination
         paginator = Paginator(products_list, 12)
@@ -1100,6 +966,11 @@ def brand_products(request, brand_id):
         context = {
             'brand': brand,
             'products': products,
+            # Only sizes in stock somewhere in the catalog
+            'sizes': [(value, label) for value, label in Product.SIZES if value in CatalogStatsService.get_stats()['sizes']],
+            'current_filters': filters,
+            # Carried over by the pagination links
+            'filter_query': urlencode({key: value for key, value in filters.items() if value}),
         }
         
         return render(request, 'shoes_view/brand_products.html', context)
@@ -1128,23 +999,9 @@ def user_register(request):
                     preferred_language=get_language()
                 )
                 
-                # Migrate session cart to user cart
-                session_cart = request.session.get('cart', {})
-                for item_data in session_cart.values():
-                    try:
-                        product = Product.objects.get(id=item_data['product_id'])
-                        CartItem.objects.create(
-                            user=user,
-                            product=product,
-                            size=item_data['size'],
-                            quantity=item_data['quantity']
-                        )
-                    except Product.DoesNotExist:
-                        continue
-                
-                # Clear session cart
-                request.session['cart'] = {}
-                request.session.modified = True
+                # Migrate guest cart and wheel prizes to the user
+                CartService.merge_guest_cart(request, user)
+                WheelService.merge_guest_spins(request, user)
                 
                 # Login user
                 username = form.cleaned_data['username']
@@ -1183,29 +1040,11 @@ def user_login(request):
                 password = form.cleaned_data['password']
                 user = authenticate(username=username, password=password)
                 if user:
+                    # Migrate guest cart and wheel prizes to the user (before login() rotates the session key)
+                    CartService.merge_guest_cart(request, user)
+                    WheelService.merge_guest_spins(request, user)
                     login(request, user)
                     
-                    # Migrate session cart to user cart
-                    session_cart = request.session.get('cart', {})
-                    for item_data in session_cart.values():
-                        try:
-                            product = Product.objects.get(id=item_data['product_id'])
-                            cart_item, created = CartItem.objects.get_or_create(
-                                user=user,
-                                product=product,
-                                size=item_data['size'],
-                                defaults={'quantity': item_data['quantity']}
-                            )
-                            if not created:
-                                cart_item.quantity += item_data['quantity']
-                                cart_item.save()
-                        except Product.DoesNotExist:
-                            continue
-                    
-                    # Clear session cart
-                    request.session['cart'] = {}
-                    request.session.modified = True
-                    
                     messages.success(request, 'تم تسجيل الدخول بنجاح!')
                     next_url = request.GET.get('next', 'shoes_view:home')
                     return redirect(next_url)
@@ -1252,48 +1091,17 @@ def user_profile(request):
 def get_cart_content(request):
     """Get cart content for side cart"""
     try:
-        cart = request.session.get('cart', {})
-        cart_items_data = []
-        total_amount = 0
-
-        if request.user.is_authenticated:
-            # Get cart items from database
-            cart_items = CartItem.objects.filter(user=request.user).select_related('product', 'product__brand')
-            for item in cart_items:
-                cart_items_data.append({
-                    'product': item.product,
-                    'quantity': item.quantity,
-                    'size': item.size,
-                    'color': item.color,
-                    'id': item.id,  # Using DB id for logged in users
-                })
-                total_amount += item.get_total_price()
-        else:
-            # Session-based cart for anonymous users
-            if cart:
-                product_ids = [item['product_id'] for item in cart.values()]
-                products = Product.objects.filter(id__in=product_ids).select_related('brand')
-                product_map = {p.id: p for p in products}
-
-                for key, item in cart.items():
-                    product = product_map.get(item.get('product_id'))
-                    if product:
-                        cart_items_data.append({
-                            'product': product,
-                            'quantity': item['quantity'],
-                            'size': item['size'],
-                            'color': item.get('color', ''),
-                            'id': key,  # Using cart_key for session users
-                        })
-                        total_amount += product.price * item['quantity']
+        cart_items_data = CartService.get_cart_items(request)
+        cart_summary = CartService.get_summary(request)
+        total_amount = cart_summary.total
 
         # Get available discount
-        available_discount = WheelService.get_available_discount(request)
+        available_discount = WheelService.get_state(request).discount
         discount_amount = (total_amount * available_discount) / 100 if available_discount else 0
         final_amount = total_amount - discount_amount
 
         # Get cart count
-        num_items = sum(item['quantity'] for item in cart_items_data)
+        num_items = cart_summary.count
 
         # Render cart content template
         context = {
@@ -1357,48 +1165,21 @@ def update_cart_quantity(request):
         if not cart_key:
             return JsonResponse({'success': False, 'message': 'لم يتم تقديم معرّف المنتج'})
 
-        if request.user.is_authenticated:
-            cart_item = get_object_or_404(CartItem, id=cart_key, user=request.user)
-            
-            if quantity > 0:
-                # Check against stock
-                if quantity > cart_item.product.stock_quantity:
-                    return JsonResponse({
-                        'success': False, 
-                        'message': f'الكمية المتاحة هي {cart_item.product.stock_quantity} فقط'
-                    })
-                cart_item.quantity = quantity
-                cart_item.save()
-            else:
-                cart_item.delete()
-        else:
-            cart = request.session.get('cart', {})
-            
-            if cart_key in cart:
-                product_id = cart[cart_key]['product_id']
-                product = Product.objects.get(id=product_id)
-
-                if quantity > 0:
-                    if quantity > product.stock_quantity:
-                         return JsonResponse({
-                            'success': False, 
-                            'message': f'الكمية المتاحة هي {product.stock_quantity} فقط'
-                        })
-                    cart[cart_key]['quantity'] = quantity
-                else:
-                    del cart[cart_key]
-                
-                request.session['cart'] = cart
-                request.session.modified = True
+        cart_item = CartService.get_item(request, cart_key)
+        if not cart_item:
+            return JsonResponse({'success': False, 'message': 'المنتج غير موجود في السلة'})
+        
+        # Check against the stock of the item's size and color
+        available = CartService.get_available_stock(cart_item.product_id, cart_item.size, cart_item.color)
+        if quantity > available:
+            return JsonResponse({
+                'success': False, 
+                'message': f'الكمية المتاحة هي {available} فقط'
+            })
+        CartService.update_quantity(request, cart_item.id, quantity)
         
         # Calculate new cart count
-        cart_count = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user)
-            cart_count = sum(item.quantity for item in cart_items)
-        else:
-            cart = request.session.get('cart', {})
-            cart_count = sum(item['quantity'] for item in cart.values())
+        cart_count = CartService.get_cart_count(request)
         
         return JsonResponse({
             'success': True, 
@@ -1443,21 +1224,22 @@ def cancel_order(request, order_id):
                 'message': 'لا يمكن إلغاء هذا الطلب في الوقت الحالي'
             })
         
-        # Cancel the order
-        order.status = 'cancelled'
-        order.save()
-        
-        # Save cancellation to file first (most important)
-        try:
-            FileService.save_cancellation_to_file(order)
-        except Exception as e:
-            logger.error(f"Cancellation file service failed for order {order.order_id}: {str(e)}")
-        
-        # Send cancellation notifications (non-blocking)
-        try:
-                            TelegramService.send_cancellation_notification(order)
-        except Exception as e:
-                          logger.warning(f"Telegram cancellation notification failed for order {order.order_id}: {str(e)}")
+        # Cancel the order and return its pieces to stock
+        with transaction.atomic():
+            # Conditional update so a double submit cannot restock twice
+            cancelled = Order.objects.filter(
+                pk=order.pk, status__in=['pending', 'confirmed', 'processing']
+            ).update(status='cancelled', updated_at=timezone.now())
+            if not cancelled:
+                return JsonResponse({
+                    'success': False,
+                    'message': 'لا يمكن إلغاء هذا الطلب في الوقت الحالي'
+                })
+            order.status = 'cancelled'
+            OrderService.restock_order(order)  # No-op for orders placed before stock was reserved
+            
+            # Cancellation file and Telegram notification run in the order worker
+            OrderEventService.enqueue(order, 'cancelled')
         
         logger.info(f"Order {order.order_id} cancelled by user")
         
@@ -1511,6 +1293,7 @@ def reorder(request, order_id):
                     request, 
                     order_item.product.id, 
                     order_item.size, 
+                    order_item.color,
                     available_quantity
                 )
                 
@@ -1546,19 +1329,22 @@ def search_suggestions(request):
         if len(query) < 1:
             return JsonResponse({'suggestions': []})
         
-        # Search products - faster query with only needed fields
+        # Served from the in-memory index once it is built
+        suggestions = SearchIndexService.search(query, limit=10)
+        if suggestions is not None:
+            return JsonResponse({'suggestions': suggestions})
+        
+        # Index still cold - search products with only needed fields
         products = Product.objects.filter(
             Q(name__icontains=query) | Q(name_en__icontains=query) | Q(brand__name__icontains=query),
             is_active=True
-        ).select_related('brand').only(
-            'id', 'name', 'name_en', 'price', 'brand__name'
-        )[:10]
+        ).for_listing()[:10]
         
         suggestions = []
         for product in products:
-            # Use the existing get_main_image method
-            main_image = product.get_main_image()
-            image_url = main_image.url if main_image else None
+            # Thumbnail path is denormalized on the product, so this does not hit the database
+            thumbnail = product.get_thumbnail()
+            image_url = thumbnail.url if thumbnail else None
             
             suggestions.append({
                 'id': product.id,
@@ -1576,26 +1362,120 @@ def search_suggestions(request):
         return JsonResponse({'suggestions': []})
 
 
-def cart_count_api(request):
-    """API endpoint to get current cart count"""
+def product_card(product):
+    """JSON product card for the listing API, with resolved image URLs"""
+    image = product.get_main_image()
+    variants = product.main_image_variants
+    card_jpg = ImageService.get_variant_path(variants, 480, 'jpg')
+    card_webp = ImageService.get_variant_path(variants, 480, 'webp')
+    return {
+        'id': product.id,
+        'name': product.name,
+        'brand': product.brand.name,
+        'price': str(product.price),
+        'url': product.get_absolute_url(),
+        'image': default_storage.url(card_jpg) if card_jpg else (image.url if image else None),
+        'image_webp': default_storage.url(card_webp) if card_webp else None,
+        'image_count': product.image_count,
+        'is_featured': product.is_featured,
+        'in_stock': product.is_in_stock(),
+    }
+
+
+@CatalogCacheService.cache_page('api_products', lambda request: ['catalog'])
+def api_products(request):
+    """
+    Cursor-paginated product cards for infinite scroll.
+    
+    Takes the same filters and sorts as the products page, plus
+    after=<sort value>,<id> from the previous response's `next`.
+    """
     try:
-        cart_count = 0
+        filters = get_product_filters(request)
+        sort_field, descending = get_sort_key(filters['sort'], bool(filters['search']))
         
-        if request.user.is_authenticated:
-            # Get cart count from database
-            cart_items = CartItem.objects.filter(user=request.user)
-            cart_count = sum(item.quantity for item in cart_items)
-            logger.debug(f"Authenticated user cart count: {cart_count}")
+        products_list = filter_products(Product.objects.filter(is_active=True).for_listing(), filters)
+        products_list = sort_products(products_list, filters['sort'], searched=bool(filters['search']))
+        
+        after = request.GET.get('after')
+        if after:
+            try:
+                value, product_id = parse_product_cursor(after, sort_field)
+            except ValueError:
+                return JsonResponse({'error': 'مؤشر غير صالح'}, status=400)
+            products_list = products_list.after(sort_field, descending, value, product_id)
+        
+        try:
+            limit = min(max(int(request.GET.get('limit', 12)), 1), 48)
+        except (ValueError, TypeError):
+            limit = 12
+        
+        # One extra row tells whether another page exists, without a COUNT
+        page = list(products_list[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        
+        return JsonResponse({
+            'products': [product_card(product) for product in page],
+            'next': make_product_cursor(page[-1], sort_field) if has_more else None,
+        })
+        
+    except Exception as e:
+        logger.error(f"Products API error: {str(e)}")
+        return JsonResponse({'products': [], 'next': None}, status=500)
+
+
+def api_catalog(request):
+    """
+    JSON snapshot of the active catalog, rebuilt once per catalog version.
+    
+    Supports If-None-Match (304) and ?since=<version> for only the products
+    changed since an earlier snapshot.
+    """
+    try:
+        version = CatalogSnapshotService.get_version()
+        since = request.GET.get('since')
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            return JsonResponse({'error': 'إصدار غير صالح'}, status=400)
+        if since == version:
+            since = None
+        
+        # The gzip and identity bodies are different bytes, so they get different strong ETags
+        gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        etag = CatalogSnapshotService.make_etag(version, since, gzip)
+        variants = {CatalogSnapshotService.make_etag(version, since), CatalogSnapshotService.make_etag(version, since, True)}
+        if variants & {tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')}:
+            response = HttpResponse(status=304)
         else:
-            # Ensure session exists for anonymous users
-            if not request.session.session_key:
-                request.session.create()
+            snapshot = CatalogSnapshotService.get_delta(since, version) if since is not None else None
+            if snapshot is None:
+                # No delta available (or asked for) - send the full snapshot
+                etag = CatalogSnapshotService.make_etag(version, gzip=gzip)
+                snapshot = CatalogSnapshotService.get_snapshot(version)
             
-            # Get cart count from session
-            cart = request.session.get('cart', {})
-            cart_count = sum(item['quantity'] for item in cart.values())
-            logger.debug(f"Anonymous user cart count: {cart_count}, Session key: {request.session.session_key}")
+            if gzip:
+                response = HttpResponse(snapshot['gzip'], content_type='application/json; charset=utf-8')
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(snapshot['body'], content_type='application/json; charset=utf-8')
         
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = 'no-cache'  # Always revalidate with the ETag
+        response['X-Catalog-Version'] = str(version)
+        return response
+        
+    except Exception as e:
+        logger.error(f"Catalog API error: {str(e)}")
+        return JsonResponse({'error': 'حدث خطأ في تحميل الكتالوج'}, status=500)
+
+
+def cart_count_api(request):
+    """API endpoint to get current cart count"""
+    try:
+        cart_count = CartService.get_cart_count(request)
         return JsonResponse({'count': cart_count})
         
     except Exception as e: